@@ -0,0 +1,249 @@
+"""
+Benchmarks for WordStorage loading and anagram searches.
+
+Queries are drawn from the long word list with a fixed seed, so two runs on the same word lists search exactly the
+same things. Every mode runs in a fresh process so peak RSS is that mode's own and nothing is left warm from the one
+before it. The anagram result cache is turned off.
+
+Run from the repository root:
+    python -m benchmarks.word_storage --out before.json
+    python -m benchmarks.word_storage --out after.json --compare before.json
+
+``--check`` makes sure count_anagrams, has_anagram and iter_anagrams (ranked or not) agree before timing anything.
+"""
+import argparse
+import json
+import multiprocessing
+import pathlib
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent import futures
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not on windows
+    resource = None
+
+from bot.util import word_index
+from bot.util.word_storage import BLANK, WordStorage
+
+
+# name: (seed length, iter_anagrams keyword arguments)
+MODES = {
+    'single': (9, {'min_length': 1}),
+    'single_min4': (9, {'min_length': 4}),
+    'ranked': (9, {'min_length': 4, 'ranked': True}),
+    'multi': (12, {'min_length': 3, 'multi_word': True}),
+    'exact': (14, {'min_length': 3, 'multi_word': True, 'exact': True}),
+}
+
+
+def _peak_rss():
+    """Peak resident memory of this process in bytes, or None if it can't be known."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _storage_kwargs(folder, engine):
+    return {'fp': str(folder), 'engine': engine, 'cache_bytes': 0}
+
+
+def make_corpus(folder, length, count, seed):
+    """``count`` different seeds of ``length`` letters cut out of long words, the same for the same seed."""
+    storage = WordStorage(**_storage_kwargs(folder, 'matrix'))
+    words = sorted({word.word[:length] for word in storage.long_words if len(word) >= length})
+    return random.Random(seed).sample(words, min(count, len(words)))
+
+
+def bench_build(folder):
+    folder = pathlib.Path(folder)
+    with tempfile.TemporaryDirectory() as temp:
+        start = time.perf_counter()
+        word_index.build_index(
+            folder / 'words.txt',
+            folder / 'google-10000-english-no-swears.txt',
+            folder / 'google-10000-english-usa-no-swears-long.txt',
+            pathlib.Path(temp) / 'words.idx',
+        )
+        elapsed = time.perf_counter() - start
+    return {'wall': elapsed, 'peak_rss': _peak_rss()}
+
+
+def bench_load(folder, engine, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        WordStorage(**_storage_kwargs(folder, engine))
+        times.append(time.perf_counter() - start)
+    return {'wall': sum(times), 'median': statistics.median(times), 'runs': repeat, 'peak_rss': _peak_rss()}
+
+
+def bench_queries(folder, engine, corpus, kwargs, max_results):
+    storage = WordStorage(**_storage_kwargs(folder, engine))
+    loaded_rss = _peak_rss()
+    latencies = []
+    results = 0
+    capped = 0
+    for query in corpus:
+        start = time.perf_counter()
+        found = 0
+        for _ in storage.iter_anagrams(query, **kwargs):
+            found += 1
+            if found >= max_results:
+                capped += 1
+                break
+        latencies.append(time.perf_counter() - start)
+        results += found
+    wall = sum(latencies)
+    return {
+        'wall': wall,
+        'queries': len(corpus),
+        'results': results,
+        'capped': capped,
+        'results_per_sec': results / wall if wall else None,
+        'latency_median': statistics.median(latencies) if latencies else None,
+        'latency_p95': float(np.percentile(latencies, 95)) if latencies else None,
+        'latency_max': max(latencies, default=None),
+        'loaded_rss': loaded_rss,
+        'peak_rss': _peak_rss(),
+    }
+
+
+# Non letters that show up in real input and have to be ignored the same way everywhere
+_NOISE = ("{0}'", '1{0}', '{0} ', '?{0}')
+_CHECKS = (
+    {'min_length': 1},
+    {'min_length': 4},
+    {'min_length': 1, 'exact': True},
+    {'min_length': 4, 'exact': True},
+)
+
+
+def check_agreement(folder, engine, corpus):
+    """Raises AssertionError if counting, checking and searching disagree on any query or noisy variant of it."""
+    storage = WordStorage(**_storage_kwargs(folder, engine))
+    for query in corpus:
+        for variant in [query] + [noise.format(query[:6]) for noise in _NOISE]:
+            for kwargs in _CHECKS:
+                found = sorted(storage.iter_anagrams(variant, **kwargs))
+                ranked = sorted(storage.iter_anagrams(variant, ranked=True, **kwargs))
+                count = storage.count_anagrams(variant, **kwargs)
+                has = storage.has_anagram(variant, **kwargs)
+                assert found == ranked, (variant, kwargs, 'ranked results differ')
+                assert count == len(found), (variant, kwargs, count, len(found))
+                assert has == bool(found), (variant, kwargs, has, len(found))
+            if BLANK in variant:
+                # Multi word searches can't have blanks
+                continue
+            short = variant[:7]
+            for exact in (False, True):
+                kwargs = {'min_length': 3, 'multi_word': True, 'exact': exact}
+                phrases = sum(1 for _ in storage.iter_anagrams(short, **kwargs))
+                count = storage.count_anagrams(short, **kwargs)
+                assert count == phrases, (short, kwargs, count, phrases)
+                assert storage.has_anagram(short, **kwargs) == bool(phrases), (short, kwargs, phrases)
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(folder, *, engine='matrix', seed=0, queries=50, repeat=5, max_results=5000, modes=None, build=False):
+    modes = list(modes or MODES)
+    report = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'engine': engine,
+        'seed': seed,
+        'queries': queries,
+        'max_results': max_results,
+        'modes': {},
+    }
+    context = multiprocessing.get_context('spawn')
+    jobs = []
+    if build:
+        jobs.append(('build', bench_build, (folder,)))
+    jobs.append(('load', bench_load, (folder, engine, repeat)))
+    for name in modes:
+        length, kwargs = MODES[name]
+        # Each mode gets its own corpus so adding one doesn't change the others
+        corpus = make_corpus(folder, length, queries, '{0}:{1}'.format(seed, name))
+        jobs.append((name, bench_queries, (folder, engine, corpus, kwargs, max_results)))
+    for name, func, args in jobs:
+        with futures.ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            report['modes'][name] = pool.submit(func, *args).result()
+    return report
+
+
+def _format_bytes(amount):
+    if amount is None:
+        return '-'
+    return '{0:.1f}M'.format(amount / 1024 / 1024)
+
+
+def print_report(report, previous=None):
+    print('commit {0}, engine {1}, seed {2}'.format(report['commit'], report['engine'], report['seed']))
+    for name, result in report['modes'].items():
+        line = '{0:<12} {1:>9.3f}s  rss {2:>8}'.format(name, result['wall'], _format_bytes(result['peak_rss']))
+        if result.get('results_per_sec') is not None:
+            line += '  {0:>10.0f} results/s  p95 {1:.4f}s'.format(result['results_per_sec'], result['latency_p95'])
+        if previous is not None and name in previous['modes'] and previous['modes'][name]['wall']:
+            line += '  ({0:+.1%} time)'.format(result['wall'] / previous['modes'][name]['wall'] - 1)
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--words', default='./storage/words/', help='folder with the word lists')
+    parser.add_argument('--engine', default='matrix', choices=('matrix', 'trie'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=50, help='queries per mode')
+    parser.add_argument('--repeat', type=int, default=5, help='how many times to load the storage')
+    parser.add_argument('--max-results', type=int, default=5000, help='stop each query after this many results')
+    parser.add_argument('--mode', action='append', choices=list(MODES), help='only run these modes')
+    parser.add_argument('--build', action='store_true', help='also time building the index from scratch')
+    parser.add_argument('--out', help='write the report as json here')
+    parser.add_argument('--compare', help='json report of an earlier run to compare against')
+    parser.add_argument('--check', action='store_true', help='check that searches agree with counts first')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        check_agreement(args.words, args.engine, make_corpus(args.words, 9, args.queries, args.seed))
+
+    report = run(
+        args.words,
+        engine=args.engine,
+        seed=args.seed,
+        queries=args.queries,
+        repeat=args.repeat,
+        max_results=args.max_results,
+        modes=args.mode,
+        build=args.build,
+    )
+    previous = None
+    if args.compare:
+        previous = json.loads(pathlib.Path(args.compare).read_text())
+    print_report(report, previous)
+    if args.out:
+        pathlib.Path(args.out).write_text(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
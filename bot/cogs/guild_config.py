@@ -2,16 +2,46 @@ from bot.util import checks
 from bot.util import database as db
 from bot.core.context import Context
 from discord.ext import commands
-from bot.util import cache
+import asyncio
+import functools
+import logging
 import re
 
 
+# Every write to guild_config notifies on this with the guild id, so other processes can update their settings
+NOTIFY_CHANNEL = 'guild_config'
+# Longest wait between tries when the database can't be reached
+MAX_RETRY_DELAY = 60
+
+# Work in every guild on top of the custom ones
+GLOBAL_PREFIXES = ('x>',)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_prefixes(prefixes):
+    """
+    Compiles a tuple of prefixes into one pattern that matches the longest of them at the start of a message.
+    Every prefix also gets a variant with a space after it, so ``x> roll`` resolves to ``x> `` and not ``x>``.
+
+    Guilds with the same prefixes share the same pattern.
+    """
+    variants = set()
+    for prefix in GLOBAL_PREFIXES + prefixes:
+        variants.update((prefix, '{0} '.format(prefix)))
+    # Alternation takes the first one that matches, so longest first
+    ordered = sorted(variants, key=lambda variant: (-len(variant), variant))
+    return re.compile('|'.join(re.escape(variant) for variant in ordered))
+
+
+DM_PREFIXES = compile_prefixes(('>',))
+
+
 async def get_guild_settings(bot, guild):
     """Get's basic guild settings information."""
     cog = bot.get_cog('GuildConfig')
     if cog is None:
-        return GuildSettings.get_default(guild)
-    return await cog.get_settings(guild.id)
+        return DEFAULT_SETTINGS
+    return cog.get_settings(guild.id)
 
 
 class GuildConfigTable(db.Table, table_name='guild_config'):
@@ -21,24 +51,31 @@ class GuildConfigTable(db.Table, table_name='guild_config'):
 
 
 class GuildSettings:
-    __slots__ = ('guild', 'prefix', 'mtg_inline')
+    __slots__ = ('guild_id', 'prefix', 'mtg_inline', 'prefixes', 'prefix_pattern')
 
-    def __init__(self, guild, prefix, mtg_inline):
-        self.guild = guild
+    def __init__(self, guild_id, prefix, mtg_inline):
+        self.guild_id = guild_id
         self.prefix = prefix
         self.mtg_inline = mtg_inline
+        # Settings get replaced instead of changed, so these only get built when the prefix does
+        self.prefixes = tuple(custom for custom in prefix.split(',') if custom)
+        self.prefix_pattern = compile_prefixes(self.prefixes)
 
     @classmethod
-    def get_default(cls, guild):
-        return cls(guild, '>,$', '')
+    def from_row(cls, row):
+        return cls(row['guild_id'], row['prefix'], row['mtg_inline'])
+
+
+# For every guild without a row. Shared, so it doesn't get built again on every message.
+DEFAULT_SETTINGS = GuildSettings(None, '>,$', '')
 
 
 async def get_guild_settings(bot, guild):
     """Get's basic guild settings information."""
     cog = bot.get_cog('GuildConfig')
     if cog is None:
-        return GuildSettings.get_default(guild)
-    return await cog.get_settings(guild.id)
+        return DEFAULT_SETTINGS
+    return cog.get_settings(guild.id)
 
 
 class GuildConfig(commands.Cog):
@@ -46,19 +83,153 @@ class GuildConfig(commands.Cog):
 
     def __init__(self, bot):
         self.bot = bot
+        # Every row of guild_config. It's loaded once and kept up to date by the commands that write to it (here or
+        # in other processes), so looking settings up on every message never has to go to the database.
+        self.settings = {}
+        self._listener = None
+        self._listen_task = None
+        # Guild ids whose rows get selected again, _reload_all selects every row instead
+        self._dirty = set()
+        self._reload_all = False
+        self._refresh_wanted = asyncio.Event()
+        self._refresh_task = None
+
+    async def cog_load(self):
+        # Listening first means nothing that changes while the rows load gets missed
+        await self.listen()
+        try:
+            await self.reload_settings()
+        except BaseException:
+            # discord.py doesn't unload a cog that failed to load, so the listener has to go now
+            await self.cog_unload()
+            raise
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def cog_unload(self):
+        for task in (self._listen_task, self._refresh_task):
+            if task is not None:
+                task.cancel()
+        listener = self._listener
+        self._listener = None
+        if listener is not None:
+            await self._release(listener)
+
+    async def listen(self):
+        """Holds a connection that listens for changes made by other processes."""
+        connection = await self.bot.pool.acquire()
+        try:
+            await connection.add_listener(NOTIFY_CHANNEL, self._on_notify)
+        except BaseException:
+            await self.bot.pool.release(connection)
+            raise
+        connection.add_termination_listener(self._on_listener_closed)
+        self._listener = connection
+
+    async def _release(self, connection):
+        try:
+            if not connection.is_closed():
+                await connection.remove_listener(NOTIFY_CHANNEL, self._on_notify)
+        finally:
+            await self.bot.pool.release(connection)
+
+    def _on_listener_closed(self, connection):
+        if self._listener is not connection:
+            # Unloaded
+            return
+        self._listener = None
+        logging.warning('Lost guild_config listener connection, reconnecting')
+        self._listen_task = asyncio.create_task(self._relisten(connection))
 
-    @cache.cache()
-    async def get_settings(self, guild_id):
-        guild = self.bot.get_guild(guild_id)
-        if guild is None:
-            return None
-        command = 'SELECT prefix, mtg_inline FROM guild_config WHERE guild_id = {0};'
-        command = command.format(guild_id)
+    async def _relisten(self, connection):
+        try:
+            await self.bot.pool.release(connection)
+        except Exception:
+            logging.exception('Failed releasing closed guild_config listener')
+        delay = 1
+        while True:
+            try:
+                await self.listen()
+            except Exception:
+                logging.exception('Failed listening for guild_config changes, retrying in {0}s'.format(delay))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            break
+        # Anything sent while there wasn't a listener is gone, so everything gets loaded again
+        self._queue_refresh(None)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self._queue_refresh(int(payload))
+
+    def _queue_refresh(self, guild_id):
+        """Has a guild's row selected again, or every row if guild_id is None."""
+        if guild_id is None:
+            self._reload_all = True
+        else:
+            self._dirty.add(guild_id)
+        self._refresh_wanted.set()
+
+    async def _refresh_loop(self):
+        # Only one refresh runs at a time, so a SELECT can never land after one that started later
+        delay = 1
+        while True:
+            await self._refresh_wanted.wait()
+            self._refresh_wanted.clear()
+            reload_all, self._reload_all = self._reload_all, False
+            dirty, self._dirty = self._dirty, set()
+            try:
+                if reload_all:
+                    await self.reload_settings()
+                elif dirty:
+                    await self.refresh_settings(dirty)
+            except Exception:
+                logging.exception('Failed refreshing guild settings, retrying in {0}s'.format(delay))
+                self._reload_all = self._reload_all or reload_all
+                self._dirty.update(dirty)
+                self._refresh_wanted.set()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+                continue
+            delay = 1
+
+    async def reload_settings(self):
+        async with db.MaybeAcquire(pool=self.bot.pool) as con:
+            rows = await con.fetch('SELECT guild_id, prefix, mtg_inline FROM guild_config;')
+        self.settings = {row['guild_id']: GuildSettings.from_row(row) for row in rows}
+
+    async def refresh_settings(self, guild_ids):
+        command = 'SELECT guild_id, prefix, mtg_inline FROM guild_config WHERE guild_id = ANY($1::bigint[]);'
         async with db.MaybeAcquire(pool=self.bot.pool) as con:
-            entry = await con.fetchrow(command)
-        if entry is None:
-            return GuildSettings.get_default(guild)
-        return GuildSettings(guild, entry['prefix'], entry['mtg_inline'])
+            rows = await con.fetch(command, list(guild_ids))
+        for row in rows:
+            self.update_settings(row)
+        for guild_id in set(guild_ids).difference(row['guild_id'] for row in rows):
+            self.settings.pop(guild_id, None)
+
+    async def write_settings(self, guild_id, column, value):  # noqa: WPS110
+        """
+        Sets one column for a guild and updates the settings map. Other processes get notified in the same
+        statement, so they only hear about it once it's committed.
+        """
+        command = (
+            'WITH updated AS ('
+            'INSERT INTO guild_config(guild_id, {0}) VALUES ($1, $2) '
+            'ON CONFLICT (guild_id) DO UPDATE SET {0} = EXCLUDED.{0} '
+            'RETURNING guild_id, prefix, mtg_inline'
+            ') SELECT updated.*, pg_notify($3, updated.guild_id::text) FROM updated;'
+        ).format(column)
+        async with db.MaybeAcquire(pool=self.bot.pool) as con:
+            row = await con.fetchrow(command, guild_id, value, NOTIFY_CHANNEL)
+        # Shows the change right away. Another process could have written after this though, and its
+        # notification might already have been handled, so select it again after.
+        self.update_settings(row)
+        self._queue_refresh(guild_id)
+
+    def get_settings(self, guild_id):
+        return self.settings.get(guild_id, DEFAULT_SETTINGS)
+
+    def update_settings(self, row):
+        self.settings[row['guild_id']] = GuildSettings.from_row(row)
 
     @commands.command(name='!prefix')
     @checks.is_manager()
@@ -71,11 +242,7 @@ class GuildConfig(commands.Cog):
         """
         if prefix is None or len(prefix) > 6 or len(prefix) < 1:
             return await ctx.send('You need to specify a prefix of max length 6 and minimum length 1!')
-        command = 'INSERT INTO guild_config(guild_id, prefix) VALUES ({0}, $1) ON CONFLICT (guild_id) DO UPDATE SET prefix = EXCLUDED.prefix;'  # noqa: WPS323
-        command = command.format(str(ctx.guild.id))
-        async with db.MaybeAcquire(pool=self.bot.pool) as con:
-            await con.execute(command, prefix)
-        self.get_settings.invalidate(self, ctx.guild.id)
+        await self.write_settings(ctx.guild.id, 'prefix', prefix)
         await ctx.send(embed=ctx.create_embed(description='Updated prefix to `{0}`'.format(prefix)))
 
     @commands.command(name='prefix')
@@ -83,11 +250,7 @@ class GuildConfig(commands.Cog):
         """
         Displays the server's current prefix.
         """
-        data = await self.get_settings(ctx.guild.id)
-        if data is None:
-            prefix = 'm$'
-        else:
-            prefix = data.prefix
+        prefix = self.get_settings(ctx.guild.id).prefix
         await ctx.send(embed=ctx.create_embed(description='Current prefix is: `{0}`'.format(prefix)))
 
     @commands.command(name='!mtgregex')
@@ -99,11 +262,7 @@ class GuildConfig(commands.Cog):
             re.compile(regex)
         except:
             return await ctx.send(embed=ctx.create_embed('That regex is invalid!', error=True))
-        command = 'INSERT INTO guild_config(guild_id, mtg_inline) VALUES ({0}, $1) ON CONFLICT (guild_id) DO UPDATE SET mtg_inline = EXCLUDED.mtg_inline;'
-        command = command.format(str(ctx.guild.id))
-        async with db.MaybeAcquire(pool=self.bot.pool) as con:
-            await con.execute(command, regex)
-        self.get_settings.invalidate(self, ctx.guild.id)
+        await self.write_settings(ctx.guild.id, 'mtg_inline', regex)
         await ctx.send(embed=ctx.create_embed('Updated mtg inline to `{0}`.'.format(regex)))
 
 
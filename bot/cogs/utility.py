@@ -1,10 +1,11 @@
 import aiohttp
 import discord
+import io
 import typing
 from discord.ext import commands
 import emoji
 from discord.ext.commands import BucketType
-from bot.util import paginator
+from bot.util import cache, formats, paginator
 from bot.core.context import Context
 
 
@@ -145,6 +146,33 @@ class Utility(commands.Cog):
             return await ctx.send(embed=ctx.create_embed('Something went wrong!', error=True), delete_after=5)
         await ctx.send(embed=ctx.create_embed(txt))
 
+    @commands.command(name='caches')
+    @commands.is_owner()
+    async def caches(self, ctx: Context):
+        """
+        Shows how well every cache is doing.
+        """
+        table = formats.TabularData()
+        table.set_columns(['Cache', 'Size', 'Hits', 'Joined', 'Misses', 'Hit %', 'Evicted', 'Loading', 'Avg load'])
+        for stats in sorted(cache.registry.values(), key=lambda cache_stats: cache_stats.name):
+            hit_rate = '-' if stats.hit_rate is None else '{0:.1f}'.format(stats.hit_rate * 100)
+            average = '-' if stats.average_load is None else '{0:.1f}ms'.format(stats.average_load * 1000)
+            table.add_row([
+                stats.name,
+                '-' if stats.size is None else stats.size,
+                stats.hits + stats.negative_hits,
+                stats.coalesced,
+                stats.misses,
+                hit_rate,
+                stats.evictions,
+                stats.in_flight,
+                average,
+            ])
+        rendered = table.render()
+        if len(rendered) > 1990:
+            return await ctx.send(file=discord.File(fp=io.BytesIO(rendered.encode('utf-8')), filename='caches.txt'))
+        await ctx.send('```\n{0}\n```'.format(rendered))
+
 
 async def setup(bot):
     await bot.add_cog(Utility(bot))
@@ -1,9 +1,74 @@
+import collections
+import logging
 import random
 
 import asyncio
 import discord
 
-from bot.util import base_game
+from bot.util import base_game, puzzle_bank
+from bot.util.word_storage import Word, signature_fits
+
+
+class RoundPool:
+    """
+    Keeps a few anagram rounds ready for every difficulty so starting a game doesn't have to find anything.
+
+    ``make_round`` is a coroutine function that takes a difficulty (or None) and returns a Puzzle. A background task
+    fills the pool up and refills it whenever a round gets taken.
+    """
+
+    def __init__(self, make_round, difficulties=(None,), *, size=3):
+        self.make_round = make_round
+        self.size = size
+        self.rounds = {difficulty: collections.deque() for difficulty in difficulties}
+        # Goes up on every reset, so rounds that were being made before one get dropped
+        self._generation = 0
+        self._wanted = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._fill())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def take(self, difficulty=None):
+        """A ready round, or None if that difficulty ran dry or isn't being filled."""
+        self._wanted.set()
+        rounds = self.rounds.get(difficulty)
+        if not rounds:
+            return None
+        return rounds.popleft()
+
+    def reset(self, difficulties):
+        """Throws away every ready round, including ones still being made, and only fills ``difficulties`` after."""
+        self._generation += 1
+        self.rounds = {difficulty: collections.deque() for difficulty in difficulties}
+        self._wanted.set()
+
+    async def _fill(self):
+        while True:
+            self._wanted.clear()
+            try:
+                await self._fill_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logging.exception('Failed making anagram round')
+                await asyncio.sleep(30)
+                continue
+            await self._wanted.wait()
+
+    async def _fill_once(self):
+        generation = self._generation
+        for difficulty, rounds in self.rounds.items():
+            while len(rounds) < self.size:
+                made = await self.make_round(difficulty)
+                if generation != self._generation:
+                    # Reset while this was being made, _wanted is already set so this starts over
+                    return
+                rounds.append(made)
 
 
 class AnagramUser(base_game.BaseGameUser):
@@ -15,26 +80,48 @@ class AnagramUser(base_game.BaseGameUser):
 
 class AnagramGame(base_game.BaseGame):
 
-    def __init__(self, word_storage, ctx, owner, end):
+    def __init__(self, word_storage, ctx, owner, end, *, puzzle=None):
         super().__init__(ctx, owner)
         self.on_end = end
-        self.anagram = list(word_storage.get_anagram_word(9))
+        self.word_storage = word_storage
+        if puzzle is None:
+            self.anagram = list(word_storage.get_anagram_word(9, min_length=4, min_count=puzzle_bank.MIN_ANSWERS))
+        else:
+            # Answers were already found ahead of time
+            self.anagram = list(puzzle.seed)
         random.shuffle(self.anagram)
         self.anagram = ''.join(self.anagram)
-        self.anagrams = list(word_storage.anagram(self.anagram, min_length=4))
+        if puzzle is None:
+            self.answers = set(word_storage.anagram(self.anagram, min_length=4))
+        else:
+            self.answers = set(puzzle.answers)
+        self.signature = Word(self.anagram).signature
+        # Answer -> id of who found it
+        self.found = {}
         self.started = False
 
     async def on_message(self, message):
         if not self.started:
             return
-        if message.content.lower() in self.anagrams:
-            self.anagrams.remove(message.content.lower())
+        guess = message.content.lower().strip()
+        if guess in self.answers:
+            if guess in self.found:
+                return await message.add_reaction('🔁')
+            self.found[guess] = message.author.id
             instance = self.user_in(message.author)
             instance.points += 1
             await message.add_reaction('👍')
+        elif self.is_short_word(guess):
+            await message.add_reaction('📏')
         else:
             await message.delete()
 
+    def is_short_word(self, guess):
+        """Real words that could be made out of the letters, but don't count since they're too short."""
+        if not guess or len(guess) >= 4 or not guess.isalpha():
+            return False
+        return signature_fits(Word(guess).signature, self.signature) and self.word_storage.is_word(guess)
+
     async def timeout(self):
         await self.ctx.send('Timed out!')
 
@@ -60,10 +147,11 @@ class AnagramGame(base_game.BaseGame):
         self.started = True
         await asyncio.sleep(90)
         winner = await self.display_scoreboard()
-        if len(self.anagrams) > 100:
-            random.shuffle(self.anagrams)
-            self.anagrams = self.anagrams[:100]
-        await self.ctx.send(embed=discord.Embed(title='Missed words', description='```\n{0}```'.format(', '.join(self.anagrams))))
+        missed = [answer for answer in self.answers if answer not in self.found]
+        if len(missed) > 100:
+            random.shuffle(missed)
+            missed = missed[:100]
+        await self.ctx.send(embed=discord.Embed(title='Missed words', description='```\n{0}```'.format(', '.join(missed))))
         await self.end(winner)
 
     async def display_scoreboard(self):
@@ -6,15 +6,17 @@ import discord
 from discord.ext import commands
 from bot.util import paginator
 from bot.core.context import Context
+from bot.util import puzzle_bank
+from bot.util.anagram_service import AnagramService, TooManySearches
 
-from bot.games.anagrams import AnagramGame
+from bot.games.anagrams import AnagramGame, RoundPool
 from bot.games.battleship import BattleShip
 from bot.games.connect_four import ConnectFour
 from bot.games.onthespot import OnTheSpot
 from bot.games.rock_paper_scissors import RPSGame
 from bot.util.game_storage import GameStorage
 from bot.util.onthespot_deck import OnTheSpotDeckHolder
-from bot.util.word_storage import WordStorage
+from bot.util.word_storage import BLANK, WordStorage
 
 
 class Games(commands.Cog):
@@ -24,6 +26,39 @@ class Games(commands.Cog):
         self.games = GameStorage()
         self.ots_decks = OnTheSpotDeckHolder()
         self.word_storage = WordStorage()
+        # Searches run in other processes so long ones don't hold up everything else
+        self.anagram_service = AnagramService()
+        # Gets loaded in the background, until then rounds get made on the spot
+        self.puzzles = None
+        self._puzzle_task = None
+        # Without the bank there's no way to pick difficulty, so only random rounds get kept until it's loaded
+        self.anagram_rounds = RoundPool(self.make_anagram_round)
+
+    async def cog_load(self):
+        self._puzzle_task = asyncio.create_task(self.load_puzzles())
+        self.anagram_rounds.start()
+
+    def cog_unload(self):
+        if self._puzzle_task is not None:
+            self._puzzle_task.cancel()
+        self.anagram_rounds.stop()
+        self.anagram_service.close()
+
+    async def load_puzzles(self):
+        loop = asyncio.get_running_loop()
+        # Building takes a few seconds of solid CPU, so keep it out of this process
+        await loop.run_in_executor(self.anagram_service.pool, puzzle_bank.build_if_stale)
+        self.puzzles = puzzle_bank.load_bank(self.word_storage)
+        # Anything already in the pool was made without knowing about difficulty
+        self.anagram_rounds.reset((None, *puzzle_bank.DIFFICULTIES))
+
+    async def make_anagram_round(self, difficulty=None, *, key=None):
+        if self.puzzles is not None:
+            puzzle = self.puzzles.choose(difficulty)
+            if puzzle is not None:
+                return puzzle
+        # No bank yet, so there's no way to pick difficulty. Still keep the search out of this process.
+        return await self.anagram_service.random_round(key=key)
 
     @commands.Cog.listener()
     async def on_message(self, message):
@@ -164,16 +199,11 @@ class Games(commands.Cog):
             return await ctx.send('30 characters is the max!')
         if len(word) < 4:
             return await ctx.send('Has to be at least 4 length!')
-        anagrams = self.word_storage.anagram(word, min_length=4, multi_word=True)
-        if len(anagrams) < 1:
-            return await ctx.send('No anagrams found!')
-        embed = ctx.create_embed(title='Anagrams for {0}'.format(word))
-        pages = paginator.SimplePages(anagrams, embed=embed)
-        await pages.start(ctx)
+        await self.send_anagrams(ctx, word, min_length=4, multi_word=True)
 
     @anagram.command(name='exact')
     @commands.is_owner()
-    async def anagram_multiword(self, ctx: Context, *, word: typing.Optional[str] = None):
+    async def anagram_exact(self, ctx: Context, *, word: typing.Optional[str] = None):
         if ctx.author.id in self.games:
             return await ctx.send(embed=ctx.create_embed("You can't find anagrams in the middle of a game!", error=True))
         if ctx.channel.id in self.games:
@@ -184,12 +214,7 @@ class Games(commands.Cog):
             return await ctx.send('30 characters is the max!')
         if len(word) < 4:
             return await ctx.send('Has to be at least 4 length!')
-        anagrams = self.word_storage.anagram(word, multi_word=True, exact=True)
-        if len(anagrams) < 1:
-            return await ctx.send('No anagrams found!')
-        embed = ctx.create_embed(title='Anagrams for {0}'.format(word))
-        pages = paginator.SimplePages(anagrams, embed=embed)
-        await pages.start(ctx)
+        await self.send_anagrams(ctx, word, multi_word=True, exact=True)
 
     async def find_anagrams(self, ctx: Context, word):
         if ctx.author.id in self.games:
@@ -202,15 +227,46 @@ class Games(commands.Cog):
             return await ctx.send('50 characters is the max!')
         if len(word) < 4:
             return await ctx.send('Has to be at least 4 length!')
-        anagrams = self.word_storage.anagram(word, min_length=4)
-        if len(anagrams) < 1:
+        if not self.word_storage.has_anagram(word, min_length=4):
             return await ctx.send('No anagrams found!')
+        # Most common words come first, and results only get pulled as pages get looked at
         embed = ctx.create_embed(title='Anagrams for {0}'.format(word))
-        pages = paginator.SimplePages(anagrams, embed=embed)
+        pages = paginator.GeneratorPages(self.word_storage.iter_anagrams(word, min_length=4, ranked=True), embed=embed)
+        await pages.start(ctx)
+
+    async def send_anagrams(self, ctx: Context, word, **kwargs):
+        if BLANK in word:
+            return await ctx.send('Blanks ({0}) only work with `anagram find`!'.format(BLANK))
+        key = ctx.guild.id if ctx.guild else ctx.author.id
+        budget = self.anagram_service.budget
+        try:
+            async with ctx.typing():
+                # The service stops the search after its budget, this is only in case a worker gets stuck
+                result = await asyncio.wait_for(self.anagram_service.anagram(word, key=key, **kwargs), budget * 2)
+        except TooManySearches:
+            return await ctx.send(embed=ctx.create_embed('Too many anagram searches are running! Try again in a bit.', error=True))
+        except asyncio.TimeoutError:
+            return await ctx.send(embed=ctx.create_embed('Finding anagrams took too long!', error=True))
+        if len(result) < 1:
+            if result.partial:
+                return await ctx.send('No anagrams found in time!')
+            return await ctx.send('No anagrams found!')
+        title = 'Anagrams for {0}'.format(word)
+        if result.partial:
+            title = '{0} (ran out of time)'.format(title)
+        embed = ctx.create_embed(title=title)
+        pages = paginator.SimplePages(result.words, embed=embed)
         await pages.start(ctx)
 
     @anagram.command(name='start')
-    async def anagram_start(self, ctx: Context):
+    async def anagram_start(self, ctx: Context, difficulty: typing.Optional[str] = None):
+        """
+        Starts a game of anagrams. Difficulty can be easy, medium or hard.
+        """
+        if difficulty is not None:
+            difficulty = difficulty.lower()
+            if difficulty not in puzzle_bank.DIFFICULTIES:
+                return await ctx.send(embed=ctx.create_embed('Difficulty has to be easy, medium or hard!', error=True))
         if ctx.channel.id in self.games:
             game = self.games.get_channel(ctx.channel.id).game_obj
             if game.started:
@@ -223,7 +279,15 @@ class Games(commands.Cog):
                 return await ctx.send(embed=ctx.create_embed("You aren't in charge of the game!"))
         if ctx.author.id in self.games:
             return await ctx.send(embed=ctx.create_embed("You can't be in multiple games!", error=True))
-        ana = AnagramGame(self.word_storage, ctx, ctx.author, self.end)
+        puzzle = self.anagram_rounds.take(difficulty)
+        if puzzle is None:
+            try:
+                puzzle = await self.make_anagram_round(difficulty, key=ctx.guild.id)
+            except TooManySearches:
+                return await ctx.send(embed=ctx.create_embed('Too many anagram searches are running! Try again in a bit.', error=True))
+            except asyncio.TimeoutError:
+                return await ctx.send(embed=ctx.create_embed('Finding a round took too long! Try again.', error=True))
+        ana = AnagramGame(self.word_storage, ctx, ctx.author, self.end, puzzle=puzzle)
         self.games.create_game(ana, ctx.guild.id, ctx.channel.id)
         await ctx.send(
             embed=ctx.create_embed('Waiting one minute to start...\nDo `{0}join` to enter!'.format(ctx.prefix))
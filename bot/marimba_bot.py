@@ -27,24 +27,20 @@ description = 'Fun bot'
 
 
 async def get_prefix(bot_obj, message: discord.Message):
-    user_id = bot_obj.user.id
-    prefixes = ['x>', '<@!{0}> '.format(user_id)]
-    space = ['x> ', '<@!{0}> '.format(user_id)]
+    message_content: str = message.content
+    mention = bot_obj.mention_prefix
+    if message_content.startswith(mention):
+        return mention
     if message.guild is None:
-        custom_prefix = ['>']
+        pattern = guild_config.DM_PREFIXES
     else:
-        custom_prefix = await bot_obj.get_guild_prefixes(message.guild)
-        if custom_prefix is None:
-            custom_prefix = ['>']
-    message_content: str = message.content
-    if message_content.startswith('x> '):
-        return space
-    for prefix in custom_prefix:
-        if message_content.startswith('{0} '.format(prefix)):
-            space.append('{0} '.format(prefix))
-            return space
-    prefixes.extend(custom_prefix)
-    return prefixes
+        settings = await guild_config.get_guild_settings(bot_obj, message.guild)
+        pattern = settings.prefix_pattern
+    match = pattern.match(message_content)
+    if match is None:
+        # Not a command, anything that doesn't match works
+        return mention
+    return match.group()
 
 
 class MarimbaBot(commands.Bot):
@@ -88,7 +84,7 @@ class MarimbaBot(commands.Bot):
         settings = await guild_config.get_guild_settings(self, guild)
         if not settings:
             return ['>']
-        return settings.prefix.split(',')
+        return list(settings.prefixes)
 
     async def get_guild_prefix(self, guild):
         prefixes = await self.get_guild_prefixes(guild)
@@ -103,6 +99,11 @@ class MarimbaBot(commands.Bot):
     async def start(self) -> None:
         await super().start(bot_global.config['bot_token'], reconnect=True)
 
+    @discord.utils.cached_property
+    def mention_prefix(self):
+        # Only used once logged in, when the user is known
+        return '<@!{0}> '.format(self.user.id)
+
     @discord.utils.cached_property
     def log(self):
         return self.get_channel(bot_global.config['log_channel'])
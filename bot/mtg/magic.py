@@ -9,7 +9,7 @@ from bot.cogs import guild_config
 from bot.mtg.card_search import CardSearch, CardPrintsSource
 from bot.mtg.magic_page import SingleCardMenu
 import bot.mtg.rules as rules
-from bot.util import queue as async_queue, queue
+from bot.util import cache, queue as async_queue, queue
 
 from discord.ext import commands, menus
 from bot.core.context import Context
@@ -34,6 +34,18 @@ def rulings_embed(card, rulings):
     return embed
 
 
+# Card data barely changes, so lookups are kept on disk between restarts
+scryfall_disk = cache.DiskCache('./storage/cache/scryfall.sqlite', ttl=24 * 60 * 60)
+
+
+@cache.cache(maxsize=256, key=lambda fuzzy: fuzzy.lower(), disk=scryfall_disk)
+async def fetch_named(fuzzy):
+    """Scryfall json of the card that best matches fuzzy."""
+    card = scrython.cards.Named(fuzzy=fuzzy)
+    await card.request_data()
+    return card.scryfallJson
+
+
 class Searched(CardsObject):
 
     def __init__(self, json, **kwargs):
@@ -51,8 +63,7 @@ class MagicCard(commands.Converter):
         async with ctx.typing():
             async with async_queue.QueueProcess(self.queue):
                 try:
-                    card = scrython.cards.Named(fuzzy=argument)
-                    await card.request_data(loop=ctx.bot.loop)
+                    card = Searched(await fetch_named(argument))
                 except scrython.foundation.ScryfallError as e:
                     if self.raise_again:
                         raise e
@@ -303,3 +314,8 @@ class Magic(commands.Cog):
 
 async def setup(bot):
     await bot.add_cog(Magic(bot))
+
+
+async def teardown(bot):
+    # The disk cache belongs to the module, not the cog
+    scryfall_disk.close()
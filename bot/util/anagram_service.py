@@ -0,0 +1,219 @@
+"""
+Runs anagram searches in worker processes so big searches don't block the event loop.
+
+Every search gets a time budget. When it runs out the worker stops and whatever was found so far comes back
+marked as partial. If the awaiting coroutine gets cancelled (the command timed out, the cog unloaded...) the worker
+is interrupted as well instead of finishing a search nobody is waiting for.
+
+Workers interrupt themselves with signals, so budgets are only enforced mid search on platforms with
+signal.setitimer. Elsewhere they're checked between results.
+"""
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+from concurrent import futures
+
+from bot.util import puzzle_bank
+from bot.util.word_storage import WordStorage
+
+
+class TooManySearches(Exception):
+    pass
+
+
+class AnagramResult:
+
+    __slots__ = ('words', 'partial')
+
+    def __init__(self, words, partial):
+        self.words = words
+        self.partial = partial
+
+    def __len__(self):
+        return len(self.words)
+
+
+class _Interrupted(Exception):
+    pass
+
+
+# Worker process state
+_storage = None
+_cancelled = None
+_current_slot = None
+
+
+def _init_worker(storage_kwargs, cancelled):
+    global _storage, _cancelled  # noqa: WPS420
+    _storage = WordStorage(**storage_kwargs)
+    _cancelled = cancelled
+    if hasattr(signal, 'setitimer'):
+        signal.signal(signal.SIGALRM, _interrupt)
+        signal.signal(signal.SIGUSR1, _interrupt_if_cancelled)
+
+
+def _interrupt(signum, frame):
+    if _current_slot is not None:
+        raise _Interrupted()
+
+
+def _interrupt_if_cancelled(signum, frame):
+    # The parent can signal a bit late, make sure this is still the search that was cancelled
+    if _current_slot is not None and _cancelled[_current_slot]:
+        raise _Interrupted()
+
+
+def _search(slot, deadline, word, max_num, kwargs):
+    global _current_slot  # noqa: WPS420
+    words = []
+    timed = hasattr(signal, 'setitimer')
+    try:
+        _current_slot = slot
+        if _cancelled[slot]:
+            return words, True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return words, True
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, remaining)
+        for found in _storage.iter_anagrams(word, **kwargs):
+            if len(words) >= max_num:
+                break
+            words.append(found)
+            if not timed and time.time() > deadline:
+                return words, True
+    except _Interrupted:
+        return words, True
+    finally:
+        _current_slot = None
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return words, False
+
+
+def _random_round(slot, deadline, length, min_length):
+    """Like _search, but a round is no use half done, so running out of time gives None."""
+    global _current_slot  # noqa: WPS420
+    timed = hasattr(signal, 'setitimer')
+    try:
+        _current_slot = slot
+        remaining = deadline - time.time()
+        if _cancelled[slot] or remaining <= 0:
+            return None
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, remaining)
+        seed = _storage.get_anagram_word(length, min_length=min_length, min_count=puzzle_bank.MIN_ANSWERS)
+        return seed, _storage.anagram(seed, min_length=min_length)
+    except _Interrupted:
+        return None
+    finally:
+        _current_slot = None
+        if timed:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+class AnagramService:
+    """
+    Process pool for WordStorage searches.
+
+    Only ``max_per_key`` searches can be running for one key (usually a guild) at a time, and only
+    ``max_queued`` in total. Past that TooManySearches gets raised.
+    """
+
+    def __init__(self, *, workers=2, max_per_key=2, max_queued=16, budget=10, storage_kwargs=None):
+        self.budget = budget
+        self.max_per_key = max_per_key
+        self._running = {}
+        self._free_slots = list(range(max_queued))
+        context = multiprocessing.get_context('spawn')
+        self._cancelled = context.Array('b', max_queued, lock=False)
+        self.pool = futures.ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(storage_kwargs or {}, self._cancelled),
+        )
+
+    async def anagram(self, word, *, key=None, budget=None, max_num=5000, **kwargs):
+        """
+        Same arguments as WordStorage.anagram, returns an AnagramResult.
+
+        :param key: What to limit concurrent searches by
+        :param budget: Seconds the search can take, including time spent waiting for a worker
+        """
+        if budget is None:
+            budget = self.budget
+        words, partial = await self._submit(key, _search, time.time() + budget, word, max_num, kwargs)
+        return AnagramResult(words, partial)
+
+    async def _submit(self, key, func, deadline, *args):
+        """Runs ``func(slot, deadline, *args)`` in a worker, taking a slot for it until the worker is done."""
+        if self._running.get(key, 0) >= self.max_per_key:
+            raise TooManySearches('Too many searches running for {0}'.format(key))
+        if not self._free_slots:
+            raise TooManySearches('Too many searches queued')
+        slot = self._free_slots.pop()
+        self._cancelled[slot] = 0
+        self._running[key] = self._running.get(key, 0) + 1
+
+        loop = asyncio.get_running_loop()
+        try:
+            future = self.pool.submit(func, slot, deadline, *args)
+        except Exception:
+            self._free_slots.append(slot)
+            self._release(key)
+            raise
+        # The slot stays taken until the worker is actually done with it. Done callbacks run on the executor's
+        # thread, so hand it back on the loop.
+        future.add_done_callback(lambda _: self._free_slot_threadsafe(loop, slot))
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            self._cancel(future, slot)
+            raise
+        finally:
+            self._release(key)
+
+    def _free_slot_threadsafe(self, loop, slot):
+        try:
+            loop.call_soon_threadsafe(self._free_slots.append, slot)
+        except RuntimeError:
+            # The loop is closed, nothing is going to take it again anyway
+            pass
+
+    def _release(self, key):
+        self._running[key] -= 1
+        if not self._running[key]:
+            self._running.pop(key)
+
+    async def random_round(self, *, key=None, budget=None, length=9, min_length=4):
+        """
+        Picks a seed like WordStorage.get_anagram_word and finds its answers in a worker. Takes a slot and a budget
+        like anagram, and raises asyncio.TimeoutError if the budget runs out.
+        """
+        if budget is None:
+            budget = self.budget
+        found = await self._submit(key, _random_round, time.time() + budget, length, min_length)
+        if found is None:
+            raise asyncio.TimeoutError('Finding an anagram round took too long')
+        seed, answers = found
+        return puzzle_bank.Puzzle(seed, answers)
+
+    def _cancel(self, future, slot):
+        if future.cancel():
+            return
+        self._cancelled[slot] = 1
+        if not hasattr(signal, 'SIGUSR1'):
+            # The search will time out on its own
+            return
+        # Workers only check the flag when they get the signal, and we don't know which one has the search
+        for pid in self.pool._processes or {}:  # noqa: WPS437
+            try:
+                os.kill(pid, signal.SIGUSR1)
+            except ProcessLookupError:
+                pass
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -8,22 +8,82 @@ Rapptz did in RoboDanny.
 Tutorial on how this stuff works: https://realpython.com/primer-on-python-decorators/#caching-return-values
 """
 import asyncio
+import collections
+import heapq
 import inspect
+import logging
+import pathlib
+import pickle
+import sqlite3
 import time
+from concurrent import futures
 from functools import wraps
 
 from lru import LRU
 
 
-def _wrap_and_store_coroutine(parent_cache, key, coroutine_func):
+# Stands in for "not cached", since None can be cached as well
+_MISSING = object()
+
+
+def _wrap_and_store_coroutine(store, key, coroutine_func):
     async def func():
         function_result = await coroutine_func
-        parent_cache[key] = function_result
+        store(key, function_result)
         return function_result
 
     return func()
 
 
+def _load_once(store, pending, key, coroutine_func, stats):
+    """
+    Runs the coroutine in a task that everyone asking for key while it's loading shares. Only results get stored,
+    errors go to every waiter and the next call tries again.
+    """
+    started = time.perf_counter()
+    task = asyncio.ensure_future(coroutine_func)
+    pending[key] = task
+
+    def done(finished):
+        if finished.cancelled():
+            if pending.get(key) is finished:
+                pending.pop(key)
+            return
+        stats.record_load(time.perf_counter() - started)
+        # Calling exception() also stops asyncio from complaining about it when every waiter got cancelled
+        error = finished.exception()
+        if pending.get(key) is not finished:
+            # Got invalidated while loading, so the result could already be outdated
+            return
+        pending.pop(key)
+        if error is None:
+            store(key, finished.result())
+
+    task.add_done_callback(done)
+    return task
+
+
+async def _load_through_disk(disk, pending, key, func, args, kwargs):
+    try:
+        stored_value = await disk.get(str(key), _MISSING)
+    except (sqlite3.Error, OSError, RuntimeError):
+        # A broken (or closed) disk tier just means going to the source every time
+        logging.exception('Failed reading {0} from {1}'.format(key, disk.path))
+        stored_value = _MISSING
+    if stored_value is not _MISSING:
+        return stored_value
+    function_result = await func(*args, **kwargs)
+    # Runs inside the task from _load_once. If that isn't pending anymore the key got invalidated meanwhile.
+    if function_result is not None and pending.get(key) is asyncio.current_task():
+        disk.set_soon(str(key), function_result)
+    return function_result
+
+
+async def _wait_for_load(task):
+    # One waiter getting cancelled shouldn't cancel the load for everyone else
+    return await asyncio.shield(task)
+
+
 def _wrap_new_coroutine(function_to_wrap):
     async def new_coroutine():
         return function_to_wrap
@@ -32,9 +92,21 @@ def _wrap_new_coroutine(function_to_wrap):
 
 
 # https://github.com/Rapptz/RoboDanny/blob/rewrite/cogs/utils/cache.py#L22
-class ExpiringDict(dict):   # noqa: WPS600
-    def __init__(self, seconds):
+class ExpiringDict(collections.OrderedDict):   # noqa: WPS600
+    """
+    Dict where every key expires after a while. Expiry times are kept in a min heap, so only keys that actually
+    expired get looked at instead of every key on every access.
+
+    With maxsize the least recently used keys get evicted once there are more than that.
+    """
+
+    def __init__(self, seconds, maxsize=None):
         self._default_expiring = seconds
+        self.maxsize = maxsize
+        self._callback = None
+        # (expire time, key). Entries stay in here after their key gets overwritten or removed, they're skipped
+        # when they come up.
+        self._expiry = []
         super().__init__()
 
     def __contains__(self, key):
@@ -43,30 +115,244 @@ class ExpiringDict(dict):   # noqa: WPS600
 
     def __getitem__(self, key):
         self._verify_cache_integrity()
-        return super().__getitem__(key)[0]
+        value = super().__getitem__(key)[0]
+        self.move_to_end(key)
+        return value
+
+    def __len__(self):
+        self._verify_cache_integrity()
+        return super().__len__()
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        self._verify_cache_integrity()
+        if not super().__contains__(key):
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return super().pop(key)[0]
 
     def set(self, key, value, seconds):
         return self.__setitem__(key, value, seconds=seconds)
 
+    def set_callback(self, callback):
+        """Calls callback(key, value) whenever a key gets evicted for going over maxsize, like LRU.set_callback."""
+        self._callback = callback
+
     def __setitem__(self, key, value, *, seconds=-1):  # noqa: WPS110
         if seconds < 0:
             seconds = self._default_expiring
-        super().__setitem__(key, (value, time.monotonic() + seconds))
+        expire = time.monotonic() + seconds
+        super().__setitem__(key, (value, expire))
+        self.move_to_end(key)
+        heapq.heappush(self._expiry, (expire, _HeapKey(key)))
+        self._verify_cache_integrity()
+        if self.maxsize is not None:
+            while super().__len__() > self.maxsize:
+                evicted, (evicted_value, _) = self.popitem(last=False)
+                if self._callback is not None:
+                    self._callback(evicted, evicted_value)
+        # Overwritten and evicted keys leave entries behind, start over once most of the heap is those
+        if len(self._expiry) > 2 * super().__len__() + 64:  # noqa: WPS432
+            self._expiry = [(expire, _HeapKey(key)) for key, (_, expire) in self.items()]
+            heapq.heapify(self._expiry)
 
     def _verify_cache_integrity(self):
-        # Have to do this in two steps...
         current_time = time.monotonic()
-        to_remove = [
-            key for (key, (_, time_expire)) in self.items() if current_time > time_expire
-        ]
-        for key in to_remove:
-            self.pop(key)
+        while self._expiry and current_time > self._expiry[0][0]:
+            expire, key = heapq.heappop(self._expiry)
+            stored = super().get(key.key)
+            # Only remove it if it wasn't set again since
+            if stored is not None and stored[1] == expire:
+                super().__delitem__(key.key)
+
+
+class DiskCache:
+    """
+    sqlite file that sits under a cache decorator so results survive restarts.
+
+    Values get pickled and keys are the string form of cache keys, since those stay the same between runs.
+    Every entry has its own expiry time, and once the values take up more than max_bytes the least recently
+    used ones get deleted. All disk work happens one operation at a time on its own thread, so writes and
+    deletes land in the order they were made and the event loop never waits on the disk.
+
+    More than one process can share a file. The size limit is checked against what's actually in it, and writes
+    that fail (like when another process has it locked for too long) get logged and dropped.
+    """
+
+    def __init__(self, path, *, ttl=60 * 60, max_bytes=64 * 1024 * 1024):
+        self.path = pathlib.Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._connection = None
+        # Made on first use, so a closed cache opens again the next time it's needed
+        self._executor = None
+        # Writes nobody awaits, kept so they don't get garbage collected
+        self._background = set()
+
+    def _connect(self):
+        if self._connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+            try:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS entries '
+                    '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL, used REAL NOT NULL)',
+                )
+                connection.execute('CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)')
+                connection.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+            except Exception:
+                connection.close()
+                raise
+            self._connection = connection
+        return self._connection
+
+    def _get(self, key):
+        connection = self._connect()
+        row = connection.execute('SELECT value, expires FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return _MISSING
+        now = time.time()
+        if row[1] < now:
+            self._delete(key)
+            return _MISSING
+        connection.execute('UPDATE entries SET used = ? WHERE key = ?', (now, key))
+        try:
+            return pickle.loads(row[0])  # noqa: S301
+        except Exception:
+            # Written by an older version of whatever class it was
+            self._delete(key)
+            return _MISSING
+
+    def _set(self, key, value, ttl):  # noqa: WPS110
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        now = time.time()
+        connection = self._connect()
+        connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)', (key, data, now + ttl, now))
+        if self._size(connection) > self.max_bytes:
+            self._trim(now)
+
+    @staticmethod
+    def _size(connection):
+        # Other processes can write to the same file, so this can't be counted up in memory
+        return connection.execute('SELECT COALESCE(SUM(LENGTH(value)), 0) FROM entries').fetchone()[0]
+
+    def _trim(self, now):
+        connection = self._connect()
+        # Nobody else can trim at the same time
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM entries WHERE expires < ?', (now,))
+            size = self._size(connection)
+            evicted = []
+            for key, length in connection.execute('SELECT key, LENGTH(value) FROM entries ORDER BY used'):
+                if size <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                size -= length
+            connection.executemany('DELETE FROM entries WHERE key = ?', evicted)
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _delete(self, key):
+        self._connect().execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='disk-cache')
+        return self._executor
+
+    def _run(self, func, *args):
+        return asyncio.get_running_loop().run_in_executor(self._get_executor(), func, *args)
+
+    def _run_soon(self, func, *args):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop, so nothing to block anyway
+            self._get_executor().submit(self._log_errors, func, *args).result()
+            return
+        try:
+            task = loop.run_in_executor(self._get_executor(), func, *args)
+        except RuntimeError:
+            # Shut down from somewhere else
+            logging.exception('Disk cache write to {0} failed'.format(self.path))
+            return
+        self._background.add(task)
+        task.add_done_callback(self._background_done)
+
+    def _background_done(self, task):
+        self._background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            error = task.exception()
+            logging.error(
+                'Disk cache write to {0} failed'.format(self.path), exc_info=(type(error), error, error.__traceback__),
+            )
+
+    def _log_errors(self, func, *args):
+        try:
+            func(*args)
+        except Exception:
+            logging.exception('Disk cache write to {0} failed'.format(self.path))
+
+    async def get(self, key, default=None):
+        stored_value = await self._run(self._get, key)
+        if stored_value is _MISSING:
+            return default
+        return stored_value
+
+    async def set(self, key, value, ttl=None):  # noqa: WPS110
+        await self._run(self._set, key, value, self.ttl if ttl is None else ttl)
+
+    def set_soon(self, key, value, ttl=None):  # noqa: WPS110
+        """Same as set, without waiting for the write."""
+        self._run_soon(self._set, key, value, self.ttl if ttl is None else ttl)
+
+    def delete_soon(self, key):
+        self._run_soon(self._delete, key)
+
+    def close(self):
+        """Closes the file. Using the cache again afterwards opens it again."""
+        executor = self._executor
+        if executor is None:
+            return
+        self._executor = None
+        executor.submit(self._close)
+        executor.shutdown(wait=True)
+
+    def _close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+
+class _HeapKey:
+    """Keys can be anything, so the heap can't fall back to comparing them when two expire at the same time."""
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return False
 
 
 def create_key(func, *args, **kwargs):
+    """String form of a call. Used for debugging and for arguments that can't be hashed."""
     def _true_repr(argument):
         if argument.__class__.__repr__ is object.__repr__:  # noqa: WPS609
-            return '<{0.__module__}.{0.__class__.__name__}>'.format(argument.__class__)
+            return '<{0.__module__}.{0.__name__}>'.format(argument.__class__)
         return repr(argument)
 
     key = ['{0.__module__}.{0.__name__}'.format(func)]  # noqa: WPS609
@@ -77,55 +363,270 @@ def create_key(func, *args, **kwargs):
     return ':'.join(key)
 
 
+class CacheKey:
+    """
+    Key for one call of a cached function. It gets hashed once when it's made, so a lookup is one hash
+    and a tuple compare. ``str()`` gives the same thing as create_key.
+    """
+
+    __slots__ = ('func', 'args', 'kwargs', '_hash')
+
+    def __init__(self, func, args, kwargs):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        # Raises TypeError if any argument can't be hashed
+        self._hash = hash((func, args, tuple(kwargs.items())))
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if not isinstance(other, CacheKey):
+            return NotImplemented
+        if self._hash != other._hash or self.func is not other.func:
+            return False
+        return self.args == other.args and self.kwargs == other.kwargs
+
+    def __str__(self):
+        return create_key(self.func, *self.args, **self.kwargs)
+
+    def __repr__(self):
+        return '<CacheKey {0}>'.format(self)
+
+
+def make_key(func, args, kwargs, key_func=None):
+    """
+    CacheKey for a call. With key_func only what it returns for the arguments is used. If something can't be
+    hashed this falls back to create_key.
+    """
+    if key_func is not None:
+        args = (key_func(*args, **kwargs),)
+        kwargs = {}
+    try:
+        return CacheKey(func, args, kwargs)
+    except TypeError:
+        return create_key(func, *args, **kwargs)
+
+
+# Name -> CacheStats of every cache that reports how it's doing
+registry = {}
+
+
+class CacheStats:
+
+    __slots__ = (
+        'name', 'hits', 'negative_hits', 'coalesced', 'misses', 'evictions', 'loads', 'load_time', '_size', '_in_flight',
+    )
+
+    def __init__(self, name, *, size=None, in_flight=None):
+        """
+        :param size: Function that returns how many entries the cache has
+        :param in_flight: Function that returns how many loads are running
+        """
+        self.name = name
+        self.hits = 0
+        self.negative_hits = 0
+        # Lookups that joined a load someone else already started
+        self.coalesced = 0
+        self.misses = 0
+        self.evictions = 0
+        self.loads = 0
+        self.load_time = 0
+        self._size = size
+        self._in_flight = in_flight
+
+    @property
+    def size(self):
+        return self._size() if self._size is not None else None
+
+    @property
+    def in_flight(self):
+        return self._in_flight() if self._in_flight is not None else 0
+
+    @property
+    def hit_rate(self):
+        # Joining a load doesn't call the function again, so it counts as a hit
+        served = self.hits + self.negative_hits + self.coalesced
+        lookups = served + self.misses
+        if not lookups:
+            return None
+        return served / lookups
+
+    @property
+    def average_load(self):
+        """Average seconds a load took"""
+        if not self.loads:
+            return None
+        return self.load_time / self.loads
+
+    def record_load(self, seconds):
+        self.loads += 1
+        self.load_time += seconds
+
+    def evicted(self, *_):
+        # Takes arguments so it can be used as an eviction callback
+        self.evictions += 1
+
+
+def register(stats):
+    """Adds stats to the registry. A cache with the same name (like from a reloaded cog) gets replaced."""
+    registry[stats.name] = stats
+    return stats
+
+
 # TODO remake this as a class
-def cache(maxsize=64, cache_object=None):  # noqa: C901,WPS212,WPS231
+def cache(maxsize=64, cache_object=None, negative_ttl=None, key=None, tags=None, disk=None):  # noqa: C901,WPS212,WPS231
+    """
+    :param disk: DiskCache to fall back on when something isn't in memory. Only for coroutine functions.
+    :param key: Function that gets the same arguments and returns what to cache by. For when only some of them
+                matter, or some can't be hashed.
+    :param tags: Function that gets the same arguments and returns tags for the entry, like ``('guild', id)``.
+                 ``invalidate_tag`` removes every entry with a tag.
+    :param negative_ttl: Seconds to remember that the function returned None. These are kept apart from
+                         everything else so they get retried sooner. If None they aren't cached at all.
+    """
+    key_func = key
+
     def decorator(func):  # noqa: WPS212,WPS231
+        if disk is not None and not asyncio.iscoroutinefunction(func):
+            raise TypeError('Disk caches only work with coroutine functions')
         if cache_object is None:
             internal_cache = LRU(maxsize)
         else:
             internal_cache = cache_object
+        if negative_ttl:
+            negative_cache = ExpiringDict(negative_ttl, maxsize=maxsize)
+        else:
+            negative_cache = {}
+        # Keys that are being loaded right now -> task loading them
+        pending = {}
+        stats = register(CacheStats(
+            '{0.__module__}.{0.__qualname__}'.format(func),
+            size=lambda: len(internal_cache),
+            in_flight=lambda: len(pending),
+        ))
+        for store in (internal_cache, negative_cache):
+            if hasattr(store, 'set_callback'):
+                store.set_callback(stats.evicted)
+        # Tag -> keys that have it, and the other way around
+        tag_index = {}
+        key_tags = {}
+
+        def _lookup(key):
+            stored_value = internal_cache.get(key, _MISSING)
+            if stored_value is not _MISSING:
+                stats.hits += 1
+                return stored_value
+            if key in negative_cache:
+                stats.negative_hits += 1
+                return None
+            return _MISSING
+
+        def _store(key, value):  # noqa: WPS110
+            if value is None:
+                if key in internal_cache:
+                    del internal_cache[key]  # noqa: WPS420,WPS529
+                if negative_ttl:
+                    negative_cache[key] = True
+                return
+            negative_cache.pop(key, None)
+            internal_cache[key] = value
+
+        def _tag(key, args, kwargs):
+            if tags is None or key in key_tags:
+                return
+            entry_tags = tuple(tags(*args, **kwargs))
+            key_tags[key] = entry_tags
+            for tag in entry_tags:
+                tag_index.setdefault(tag, set()).add(key)
+            # Evicted keys stay tagged until their tag gets invalidated, so clear them out once they pile up
+            if len(key_tags) > 2 * (len(internal_cache) + len(pending)) + 64:  # noqa: WPS432
+                for stale in [tagged for tagged in key_tags if not _exists(tagged)]:
+                    _untag(stale)
+
+        def _untag(key):
+            for tag in key_tags.pop(key, ()):
+                keys = tag_index.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        tag_index.pop(tag)
+
+        def _exists(key):
+            return key in internal_cache or key in negative_cache or key in pending
+
+        def _drop(key):
+            # Whatever is loading right now might be from before the change
+            pending.pop(key, None)
+            negative_cache.pop(key, None)
+            _untag(key)
+            if disk is not None:
+                disk.delete_soon(str(key))
+            if key in internal_cache:
+                # No other function to replicate del
+                del internal_cache[key]  # noqa: WPS420,WPS529
+                return True
+            return False
 
         @wraps(func)
         def wrapper(*args, **kwargs):
-            key = create_key(func, args, kwargs)
-            stored_value = internal_cache.get(key, None)
-            if stored_value is None:
-                stored_value = func(*args, **kwargs)
+            key = make_key(func, args, kwargs, key_func)
+            stored_value = _lookup(key)
+            if stored_value is _MISSING:
+                if key in pending:
+                    stats.coalesced += 1
+                    return _wait_for_load(pending[key])
+                stats.misses += 1
+                _tag(key, args, kwargs)
+                started = time.perf_counter()
+                if disk is not None:
+                    stored_value = _load_through_disk(disk, pending, key, func, args, kwargs)
+                else:
+                    stored_value = func(*args, **kwargs)
                 if inspect.isawaitable(stored_value):
-                    return _wrap_and_store_coroutine(internal_cache, key, stored_value)
-                internal_cache[key] = stored_value  # noqa: WPS529
+                    return _wait_for_load(_load_once(_store, pending, key, stored_value, stats))
+                stats.record_load(time.perf_counter() - started)
+                _store(key, stored_value)
 
             if asyncio.iscoroutinefunction(func):
                 return _wrap_new_coroutine(stored_value)
             return stored_value
 
         def _set(value, *args, **kwargs):
-            key = create_key(func, args, kwargs)
+            key = make_key(func, args, kwargs, key_func)
+            _tag(key, args, kwargs)
             if inspect.isawaitable(value):
-                return _wrap_and_store_coroutine(internal_cache, key, value)
-            internal_cache[key] = value
+                return _wrap_and_store_coroutine(_set_everywhere, key, value)
+            _set_everywhere(key, value)
+
+        def _set_everywhere(key, value):  # noqa: WPS110
+            _store(key, value)
+            if disk is not None:
+                if value is None:
+                    disk.delete_soon(str(key))
+                else:
+                    disk.set_soon(str(key), value)
 
         def _invalidate(*args, **kwargs):
-            key = create_key(func, args, kwargs)
-            if key in internal_cache:
-                # No other function to replicate del
-                del internal_cache[key]  # noqa: WPS420,WPS529
-                return True
-            return False
+            return _drop(make_key(func, args, kwargs, key_func))
 
-        def _invalidate_containing(key):
-            for cache_key in internal_cache.keys():
-                if key in cache_key:
-                    # No other function to replicate del
-                    del internal_cache[cache_key]  # noqa: WPS420,WPS529
+        def _invalidate_tag(tag):
+            """Removes every entry tagged with tag. Returns how many were still cached."""
+            keys = tag_index.pop(tag, ())
+            return sum(_drop(key) for key in list(keys))
 
         def _args_exist(*args, **kwargs):
-            key = create_key(func, args, kwargs)
-            return key in internal_cache
+            key = make_key(func, args, kwargs, key_func)
+            return key in internal_cache or key in negative_cache
 
         wrapper.cache = internal_cache
+        wrapper.pending = pending
+        wrapper.negative_cache = negative_cache
+        wrapper.stats = stats
         wrapper.invalidate = _invalidate
-        wrapper.invalidate_containing = _invalidate_containing
+        wrapper.invalidate_tag = _invalidate_tag
+        wrapper.tag_index = tag_index
         wrapper.set = _set
         wrapper.exists = _args_exist
         return wrapper
@@ -1,4 +1,7 @@
+import asyncio
 import contextlib
+import itertools
+import math
 
 import discord
 from discord.ext import menus
@@ -279,3 +282,78 @@ class SimplePages(Pages):
         super().__init__(SimplePageSource(entries, per_page=per_page, numbers=numbers))
         self.embed = embed
         self.entries = entries
+
+
+class GeneratorPageSource(menus.PageSource):
+    """
+    Like SimplePageSource, but entries come from an iterator that only gets advanced as pages are requested.
+    The total isn't known until the iterator runs out, so until then pages show up as ``N/?``.
+
+    Iterators get advanced in a thread so slow ones don't block the event loop.
+    """
+
+    def __init__(self, iterator, *, per_page=15, numbers=True):
+        self.iterator = iter(iterator)
+        self.per_page = per_page
+        self.numbers = numbers
+        self.entries = []
+        self.exhausted = False
+        self._lock = asyncio.Lock()
+
+    async def _fill(self, amount):
+        # Generators can't be advanced from two threads at once
+        async with self._lock:
+            missing = amount - len(self.entries)
+            if self.exhausted or missing <= 0:
+                return
+            chunk = await asyncio.to_thread(list, itertools.islice(self.iterator, missing))
+            self.entries.extend(chunk)
+            if len(chunk) < missing:
+                self.exhausted = True
+
+    async def prepare(self):
+        # One extra to know if there's more than one page
+        await self._fill(self.per_page + 1)
+
+    def is_paginating(self):
+        return len(self.entries) > self.per_page
+
+    def get_max_pages(self):
+        if not self.exhausted:
+            return None
+        return max(1, math.ceil(len(self.entries) / self.per_page))
+
+    async def get_page(self, page_number):
+        if page_number < 0:
+            raise IndexError('Negative page number.')
+        base = page_number * self.per_page
+        await self._fill(base + self.per_page + 1)
+        entries = self.entries[base:base + self.per_page]
+        if not entries and page_number > 0:
+            raise IndexError('Went too far')
+        return entries
+
+    async def format_page(self, menu, entries):
+        pages = []
+        for index, entry in enumerate(entries, start=menu.current_page * self.per_page):
+            if self.numbers:
+                pages.append(f"**{index + 1}.** {entry}")
+            else:
+                pages.append(str(entry))
+
+        if self.is_paginating():
+            if self.exhausted:
+                footer = f"Page {menu.current_page + 1}/{self.get_max_pages()} ({len(self.entries)} entries.)"
+            else:
+                footer = f"Page {menu.current_page + 1}/? ({len(self.entries)}+ entries.)"
+            menu.embed.set_footer(text=footer)
+
+        menu.embed.description = '\n'.join(pages)
+        return menu.embed
+
+
+class GeneratorPages(Pages):
+
+    def __init__(self, iterator, *, per_page=10, embed=discord.Embed(colour=discord.Colour.purple()), numbers=True):
+        super().__init__(GeneratorPageSource(iterator, per_page=per_page, numbers=numbers))
+        self.embed = embed
@@ -0,0 +1,133 @@
+"""
+Precomputed rounds for the anagram game.
+
+Every long word gets cut down to a seed (like WordStorage.get_anagram_word) and all of its anagrams get found ahead
+of time. Seeds are sorted by how many answers they have, so picking one for a difficulty is just picking a random
+spot in a range. The bank uses the same file layout as the word index and gets rebuilt when the index changes.
+
+Run ``python -m bot.util.puzzle_bank`` to build it ahead of time.
+"""
+import pathlib
+import random
+import sys
+
+import numpy as np
+
+from bot.util import word_index
+from bot.util.word_storage import WordStorage
+
+
+MAGIC = b'MRBPUZ\x00\x00'
+VERSION = 1
+
+SEED_LENGTH = 9
+MIN_LENGTH = 4
+# Rounds with less than this aren't any fun
+MIN_ANSWERS = 5
+# More answers is easier
+DIFFICULTIES = ('easy', 'medium', 'hard')
+
+
+class Puzzle:
+
+    __slots__ = ('seed', 'answers')
+
+    def __init__(self, seed, answers):
+        self.seed = seed
+        self.answers = answers
+
+
+def build_bank(storage, out_path):
+    index = storage.index
+    set_sizes = np.diff(index.set_offsets)
+    seeds = sorted({word.word[:SEED_LENGTH] for word in storage.long_words})
+
+    kept = []
+    counts = []
+    answers = []
+    answer_offsets = [0]
+    for seed in seeds:
+        set_ids = storage.find_sets(seed, min_length=MIN_LENGTH)
+        count = int(set_sizes[set_ids].sum())
+        if count < MIN_ANSWERS:
+            continue
+        kept.append(seed)
+        counts.append(count)
+        answers.append(set_ids)
+        answer_offsets.append(answer_offsets[-1] + len(set_ids))
+
+    counts = np.array(counts, dtype=np.int32)
+    order = np.argsort(-counts, kind='stable').astype(np.int32)
+    bounds = np.linspace(0, len(order), len(DIFFICULTIES) + 1).astype(int).tolist()
+    difficulties = {
+        name: [bounds[i], bounds[i + 1]] for i, name in enumerate(DIFFICULTIES)
+    }
+    arrays = {
+        'seeds': np.frombuffer(''.join(kept).encode('ascii'), dtype=np.uint8).reshape(len(kept), SEED_LENGTH),
+        'counts': counts,
+        'order': order,
+        'answer_offsets': np.array(answer_offsets, dtype=np.int64),
+        'answers': np.concatenate(answers).astype(np.int32) if answers else np.zeros(0, dtype=np.int32),
+    }
+    word_index.write_arrays(out_path, arrays, {
+        'sources': word_index.source_signature((index.path,)),
+        'difficulties': difficulties,
+    }, magic=MAGIC, version=VERSION)
+
+
+class PuzzleBank(word_index.MappedArrays):
+
+    magic = MAGIC
+    version = VERSION
+
+    def __init__(self, path, index, *, sources=None):
+        super().__init__(path, sources=sources)
+        self.index = index
+        self.difficulties = self.header['difficulties']
+
+    def __len__(self):
+        return len(self.counts)
+
+    def get(self, position):
+        seed = self.seeds[position].tobytes().decode('ascii')
+        start, end = self.answer_offsets[position:position + 2]
+        answers = []
+        for set_id in self.answers[start:end]:
+            answers.extend(self.index.set_words(set_id))
+        return Puzzle(seed, answers)
+
+    def choose(self, difficulty=None):
+        if difficulty is None:
+            start, end = 0, len(self)
+        else:
+            start, end = self.difficulties[difficulty]
+        if start >= end:
+            return None
+        return self.get(int(self.order[random.randrange(start, end)]))
+
+
+def bank_path(storage, bank_file='puzzles.bank'):
+    return storage.index.path.parent / bank_file
+
+
+def load_bank(storage, bank_file='puzzles.bank'):
+    """Maps the puzzle bank for storage, building it first if it's missing or older than the word index."""
+    path = bank_path(storage, bank_file)
+    try:
+        return PuzzleBank(path, storage.index, sources=(storage.index.path,))
+    except (OSError, ValueError, KeyError, word_index.IndexOutdated):
+        pass
+    build_bank(storage, path)
+    return PuzzleBank(path, storage.index, sources=(storage.index.path,))
+
+
+def build_if_stale(fp='./storage/words/', bank_file='puzzles.bank'):
+    """For running in another process. Only builds, the file still has to be loaded where it gets used."""
+    load_bank(WordStorage(fp, cache_bytes=0), bank_file)
+
+
+if __name__ == '__main__':
+    folder = pathlib.Path(sys.argv[1] if len(sys.argv) > 1 else './storage/words/')
+    storage = WordStorage(folder, cache_bytes=0)
+    build_bank(storage, bank_path(storage))
+    print('Built {0}'.format(bank_path(storage)))
@@ -0,0 +1,322 @@
+"""
+Compiles the word lists in storage/words into one binary file that can be memory mapped.
+
+Parsing words.txt and building letter counts for every word takes a couple seconds, so this is done once and
+stored. Every process that loads the index maps the same file, so the pages are shared between them.
+
+Layout of the file:
+    magic (8 bytes) | version (uint32) | header length (uint32) | json header | arrays (64 byte aligned)
+
+Array offsets in the header are relative to the first aligned byte after it.
+
+Arrays:
+    counts          uint8 (sets, 26)   letter counts of every anagram set, sorted by length then first appearance
+    buckets         int64 (lengths+1)  rows of length n are counts[buckets[n]:buckets[n + 1]]
+    set_offsets     int64 (sets+1)     words of set n are strings[set_offsets[n]:set_offsets[n + 1]]
+    key_order       int32 (sets)       set ids sorted by their sorted letter key (for lookups)
+    string_offsets  int64 (strings+1)  byte ranges in the string table
+    strings         uint8              string table. Dictionary words, then common words, then long words
+    trie_first      int32 (nodes)      first child of every trie node. Children are stored next to each other
+    trie_children   uint8 (nodes)      how many children a node has
+    trie_letter     uint8 (nodes)      letter (0-25) that leads into a node
+    trie_set        int32 (nodes)      set id of the key that ends at a node, or -1
+    word_sets       int32 (words)      set id of every dictionary word (string ids 0 to words)
+    word_ranks      int32 (words)      position of every dictionary word in the common list, or UNRANKED
+    rank_order      int32 (words)      dictionary string ids from most to least common. Unranked ones are last,
+                                       in scan order
+
+The trie is over the sorted letter keys of every set, so a path only ever goes through letters in order.
+Nodes are breadth first with the root at 0.
+
+Run ``python -m bot.util.word_index`` to build it ahead of time. It also gets rebuilt automatically whenever
+one of the source files changes.
+"""
+import bisect
+import collections
+import json
+import mmap
+import os
+import pathlib
+import struct
+import sys
+import tempfile
+
+import numpy as np
+
+
+MAGIC = b'MRBWIDX\x00'
+VERSION = 3
+_PREAMBLE = struct.Struct('<8sII')
+_ALIGN = 64
+
+alphabet = 'abcdefghijklmnopqrstuvwxyz'
+
+# Rank of words that aren't in the common list
+UNRANKED = 2 ** 31 - 1
+
+
+class IndexOutdated(Exception):
+    pass
+
+
+def _read_words(path):
+    words = []
+    for line in path.read_text().splitlines():
+        if len(line) < 1:
+            continue
+        if line[0] == '#':
+            # Comments (mainly license and credits)
+            continue
+        words.append(line.lower())
+    return words
+
+
+def source_signature(paths):
+    """Size and modification time of every source, used to tell when the index is stale."""
+    signature = []
+    for path in paths:
+        stat = path.stat()
+        signature.append([path.name, stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def _build_trie(keys):
+    root = {}
+    for set_id, key in enumerate(keys):
+        node = root
+        for letter in key:
+            node = node.setdefault(letter, {})
+        node[None] = set_id
+
+    first = []
+    children = []
+    letters = []
+    sets = []
+    queue = collections.deque([(root, 0)])
+    next_node = 1
+    while queue:
+        node, letter = queue.popleft()
+        child_letters = sorted(key for key in node.keys() if key is not None)
+        first.append(next_node)
+        children.append(len(child_letters))
+        letters.append(letter)
+        sets.append(node.get(None, -1))
+        next_node += len(child_letters)
+        for child in child_letters:
+            queue.append((node[child], ord(child) - ord('a')))
+    return {
+        'trie_first': np.array(first, dtype=np.int32),
+        'trie_children': np.array(children, dtype=np.uint8),
+        'trie_letter': np.array(letters, dtype=np.uint8),
+        'trie_set': np.array(sets, dtype=np.int32),
+    }
+
+
+def build_index(word_path, common_path, long_path, out_path):
+    """Compiles the three word lists into ``out_path``. The file is swapped in atomically."""
+    sets = {}
+    for word in _read_words(word_path):
+        key = ''.join(sorted(word))
+        if key in sets:
+            sets[key].append(word)
+        else:
+            sets[key] = [word]
+    # Sorted is stable, so sets keep their first appearance order inside of each length
+    keys = sorted(sets.keys(), key=len)
+    max_length = len(keys[-1]) if keys else 0
+
+    counts = np.zeros((len(keys), len(alphabet)), dtype=np.uint8)
+    if keys:
+        letters = np.frombuffer(''.join(keys).encode('ascii'), dtype=np.uint8) - ord('a')
+        rows = np.repeat(np.arange(len(keys)), [len(key) for key in keys])
+        np.add.at(counts, (rows, letters), 1)
+
+    lengths = np.array([len(key) for key in keys], dtype=np.int64)
+    buckets = np.searchsorted(lengths, np.arange(max_length + 2)).astype(np.int64)
+    key_order = np.array(sorted(range(len(keys)), key=keys.__getitem__), dtype=np.int32)
+
+    strings = []
+    set_offsets = [0]
+    for key in keys:
+        strings.extend(sets[key])
+        set_offsets.append(len(strings))
+    lists = {'words': [0, len(strings)]}
+    for name, path in (('common', common_path), ('long', long_path)):
+        start = len(strings)
+        strings.extend(_read_words(path))
+        lists[name] = [start, len(strings)]
+
+    # The common list is sorted by how often words get used
+    common_start, common_end = lists['common']
+    common_ranks = {}
+    for rank, word in enumerate(strings[common_start:common_end]):
+        common_ranks.setdefault(word, rank)
+    word_count = lists['words'][1]
+    word_ranks = np.array([common_ranks.get(word, UNRANKED) for word in strings[:word_count]], dtype=np.int32)
+    word_sets = np.repeat(np.arange(len(keys), dtype=np.int32), np.diff(set_offsets))
+
+    encoded = [string.encode('ascii') for string in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in encoded], out=string_offsets[1:])
+    blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+    arrays = {
+        'counts': counts,
+        'buckets': buckets,
+        'set_offsets': np.array(set_offsets, dtype=np.int64),
+        'key_order': key_order,
+        'string_offsets': string_offsets,
+        'strings': blob,
+    }
+    arrays.update(_build_trie(keys))
+    arrays.update({
+        'word_sets': word_sets,
+        'word_ranks': word_ranks,
+        # Stable, so ties (all the unranked words) stay in scan order
+        'rank_order': np.argsort(word_ranks, kind='stable').astype(np.int32),
+    })
+    write_arrays(out_path, arrays, {
+        'sources': source_signature((word_path, common_path, long_path)),
+        'lists': lists,
+    })
+
+
+def _align(offset):
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def write_arrays(out_path, arrays, header, *, magic=MAGIC, version=VERSION):
+    """Writes numpy arrays and a json header in the layout described at the top. The file is swapped in atomically."""
+    header = dict(header)
+    header['arrays'] = {}
+    # Offsets are relative to the first aligned byte after the header
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        header['arrays'][name] = [array.dtype.str, list(array.shape), offset]
+        offset += array.nbytes
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(_PREAMBLE.size + len(header_bytes))
+
+    out_path = pathlib.Path(out_path)
+    descriptor, temp_name = tempfile.mkstemp(dir=str(out_path.parent), prefix=out_path.name, suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(_PREAMBLE.pack(magic, version, len(header_bytes)))
+            file.write(header_bytes)
+            for name, array in arrays.items():
+                file.seek(data_start + header['arrays'][name][2])
+                file.write(np.ascontiguousarray(array).tobytes())
+        # mkstemp only lets the owner read it
+        os.chmod(temp_name, 0o644)
+        os.replace(temp_name, str(out_path))
+    except BaseException:
+        pathlib.Path(temp_name).unlink(missing_ok=True)
+        raise
+
+
+class MappedArrays:
+    """
+    Read only view over a file written by write_arrays. Every array becomes a numpy attribute backed by the map.
+
+    If sources are given and the file was made from different versions of them, IndexOutdated gets raised.
+    """
+
+    magic = MAGIC
+    version = VERSION
+
+    def __init__(self, path, *, sources=None):
+        self.path = pathlib.Path(path)
+        with open(str(self.path), 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, header_length = _PREAMBLE.unpack_from(self._map, 0)
+            if magic != self.magic or version != self.version:
+                raise IndexOutdated('{0} is not a version {1} {2}'.format(self.path, self.version, self.magic))
+            self.header = json.loads(bytes(self._map[_PREAMBLE.size:_PREAMBLE.size + header_length]))
+            if sources is not None and self.header['sources'] != source_signature(sources):
+                raise IndexOutdated('{0} is older than its sources'.format(self.path))
+        except Exception:
+            self._map.close()
+            raise
+        self._data_start = _align(_PREAMBLE.size + header_length)
+        for name, (dtype, shape, offset) in self.header['arrays'].items():
+            count = int(np.prod(shape))
+            array = np.frombuffer(self._map, dtype=np.dtype(dtype), count=count, offset=self._data_start + offset)
+            setattr(self, name, array.reshape(shape))
+
+    def view(self, name):
+        """
+        A memoryview over an array. Indexing one of these gives plain ints, which is a lot faster than numpy
+        when walking through it one element at a time.
+        """
+        dtype, shape, offset = self.header['arrays'][name]
+        dtype = np.dtype(dtype)
+        start = self._data_start + offset
+        return memoryview(self._map)[start:start + dtype.itemsize * int(np.prod(shape))].cast(dtype.char)
+
+
+class WordIndex(MappedArrays):
+    """Read only view over a compiled index file."""
+
+    def __init__(self, path, *, sources=None):
+        super().__init__(path, sources=sources)
+        self._strings_start = self._data_start + self.header['arrays']['strings'][2]
+        self.lists = self.header['lists']
+        self.max_length = len(self.buckets) - 2
+
+    def __len__(self):
+        return len(self.counts)
+
+    def bucket(self, length):
+        """Range of set ids that have ``length`` letters."""
+        if length < 0:
+            return 0, 0
+        if length > self.max_length:
+            return len(self), len(self)
+        return int(self.buckets[length]), int(self.buckets[length + 1])
+
+    def string(self, string_id):
+        start, end = self.string_offsets[string_id:string_id + 2]
+        return self._map[self._strings_start + start:self._strings_start + end].decode('ascii')
+
+    def set_words(self, set_id):
+        start, end = self.set_offsets[set_id:set_id + 2]
+        return [self.string(i) for i in range(start, end)]
+
+    def key(self, set_id):
+        """Sorted letters of an anagram set."""
+        return ''.join(letter * int(count) for letter, count in zip(alphabet, self.counts[set_id]))
+
+    def find_key(self, key):
+        """Finds the set id for sorted letters, or None if no words use exactly those letters."""
+        position = bisect.bisect_left(self.key_order, key, key=lambda set_id: self.key(int(set_id)))
+        if position < len(self.key_order) and self.key(int(self.key_order[position])) == key:
+            return int(self.key_order[position])
+        return None
+
+    def word_list(self, name):
+        start, end = self.lists[name]
+        return [self.string(i) for i in range(start, end)]
+
+
+def load_index(word_path, common_path, long_path, out_path):
+    """Maps the compiled index, (re)building it first if it's missing or out of date."""
+    sources = (word_path, common_path, long_path)
+    try:
+        return WordIndex(out_path, sources=sources)
+    except (OSError, ValueError, KeyError, IndexOutdated, struct.error):
+        pass
+    build_index(word_path, common_path, long_path, out_path)
+    return WordIndex(out_path, sources=sources)
+
+
+if __name__ == '__main__':
+    folder = pathlib.Path(sys.argv[1] if len(sys.argv) > 1 else './storage/words/')
+    build_index(
+        folder / 'words.txt',
+        folder / 'google-10000-english-no-swears.txt',
+        folder / 'google-10000-english-usa-no-swears-long.txt',
+        folder / 'words.idx',
+    )
+    print('Built {0}'.format(folder / 'words.idx'))
@@ -1,34 +1,109 @@
+import collections
+import collections.abc
+import itertools
+import math
 import pathlib
-from collections import defaultdict, Counter
+import sys
+import time
+from collections import Counter
 import random
 
+import numpy as np
+
+from bot.util import cache, word_index
+
 
 alphabet = list('abcdefghijklmnopqrstuvwxyz')
+ENGINES = ('matrix', 'trie')
+
+
+# Signatures pack the count of every letter into one byte of an int. The top bit of every byte stays clear,
+# that way subtracting signatures can show if any letter would go below zero (see Word.__contains__).
+MAX_LETTER_COUNT = 127
+
+BLANK = '?'
+_ONES = np.ones(len(alphabet), dtype=np.uint16)
+_GUARDS = int.from_bytes(b'\x80' * len(alphabet), 'little')
+
+
+def letter_counts(word):
+    """Returns a uint8 vector with how many times each letter a-z shows up in a word."""
+    letters = np.frombuffer(word.lower().encode('ascii', 'ignore'), dtype=np.uint8) - ord('a')
+    # Anything outside of a-z wraps around past 25 and gets dropped
+    letters = letters[letters < len(alphabet)]
+    counts = np.bincount(letters, minlength=len(alphabet))
+    if len(letters) and counts.max() > MAX_LETTER_COUNT:
+        raise ValueError('Words can only have up to {0} of one letter'.format(MAX_LETTER_COUNT))
+    return counts.astype(np.uint8)
+
+
+def letter_signature(word):
+    return int.from_bytes(letter_counts(word).tobytes(), 'little')
+
+
+def fits(rows, counts, blanks=0):
+    """
+    Which rows of letter counts can be made out of counts. Every blank can stand in for one missing letter, so
+    a row fits when all the letters it's short on add up to at most blanks.
+    """
+    if not blanks:
+        return (rows <= counts).all(axis=1)
+    # Stays in uint8 since the maximum never goes under counts. Summing with a matrix product is a lot faster
+    # than sum(axis=1) on uint8 rows.
+    deficit = np.maximum(rows, counts)
+    deficit -= counts
+    return deficit @ _ONES <= blanks
+
+
+def signature_fits(signature, inside):
+    """If every letter of signature is also in inside."""
+    # With the guard bit set no letter can borrow from the next one. A letter only loses its guard bit if
+    # there isn't enough of it.
+    return ((inside | _GUARDS) - signature) & _GUARDS == _GUARDS
 
 
 class Word:
 
-    __slots__ = ('word', 'length', 'sorted')
+    __slots__ = ('word', 'signature')
 
     def __init__(self, word):
         self.word = word.lower()
-        self.length = len(self.word)
-        self.sorted = Counter(self.word)
+        self.signature = letter_signature(self.word)
+
+    @property
+    def length(self):
+        return len(self.word)
+
+    @property
+    def blanks(self):
+        """How many ``?`` are in the word. They can be used as any letter."""
+        return self.word.count(BLANK)
+
+    @property
+    def letters(self):
+        """
+        How many letters the word has, blanks included. Anything else (spaces, apostrophes...) isn't part of
+        an anagram, so this is what exact searches have to use up.
+        """
+        return int(self.counts.sum()) + self.blanks
+
+    @property
+    def counts(self):
+        return np.frombuffer(self.signature.to_bytes(len(alphabet), 'little'), dtype=np.uint8)
+
+    @property
+    def sorted(self):
+        return Counter(self.word)
 
     def __contains__(self, item):
-        item_length = len(item)
-        if self.length < item_length:
+        if len(item) > self.length:
             # A bigger word can't be found in a smaller one
             return False
-        if isinstance(item, Word):
-            item = item.sorted
-        elif isinstance(item, AnagramSet):
-            item = item.words[0].sorted
-        elif not isinstance(item, list):
-            item = Counter(list(item))
-        if self.sorted == item:
-            return True
-        return all(self.sorted[x] >= item[x] for x in item)
+        if isinstance(item, (Word, AnagramSet)):
+            item = item.signature
+        else:
+            item = letter_signature(''.join(item))
+        return signature_fits(item, self.signature)
 
     def remove(self, items):
         word = list(self.word)
@@ -39,38 +114,128 @@ class Word:
             print('{0} - {1}'.format(word, items))
             raise e
         self.word = ''.join(word)
-        self.length = len(self.word)
-        self.sorted = Counter(self.word)
+        self.signature = letter_signature(self.word)
 
     def copy(self):
-        return Word(self.word)
+        word = Word.__new__(Word)
+        word.word = self.word
+        word.signature = self.signature
+        return word
 
     def __getitem__(self, item):
         return self.word[item]
 
     def __len__(self):
-        return self.length
+        return len(self.word)
 
 
 class AnagramSet:
+    """Words that all use the same letters. They share one signature."""
 
-    __slots__ = ('sorted', 'words', 'length', 'word')
+    __slots__ = ('signature', 'words')
 
     def __init__(self, *words):
-        self.words = [Word(w) for w in words]
-        self.length = len(self.words[0])
+        self.words = [w.lower() for w in words]
+        self.signature = letter_signature(self.words[0])
+
+    @property
+    def length(self):
+        return len(self.words[0])
 
     def append(self, item):
-        self.words.append(Word(item))
+        self.words.append(item.lower())
 
     def __len__(self):
-        return self.length
+        return len(self.words[0])
 
     def size(self):
         return len(self.words)
 
     def __contains__(self, item):
-        return item in self.word[0]
+        return item in Word(self.words[0])
+
+
+class WordList(collections.abc.Sequence):
+    """One of the word lists in the index. Words are only made when they get accessed."""
+
+    __slots__ = ('index', 'start', 'end')
+
+    def __init__(self, index, name):
+        self.index = index
+        self.start, self.end = index.lists[name]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self[i] for i in range(*item.indices(len(self)))]
+        if item < 0:
+            item += len(self)
+        if item < 0 or item >= len(self):
+            raise IndexError('Word index out of range')
+        return Word(self.index.string(self.start + item))
+
+
+class AnagramCache:
+    """
+    LRU for anagram results that evicts by how much memory the results take instead of how many there are.
+
+    Results get stored as one newline joined string, which is a lot smaller than a list of strings.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self.stats = cache.register(cache.CacheStats('word_storage.anagram', size=lambda: len(self)))
+
+    @staticmethod
+    def create_key(word, min_length, multi_word, exact):
+        # Anagrams of a word are the same as anagrams of any other order of its letters
+        return ''.join(sorted(word.lower())), min_length, multi_word, exact
+
+    def get(self, key, max_num):
+        entry = self._entries.get(key)
+        # Results that got cut off can still answer for anything that wants as many or less
+        if entry is None or (not entry[2] and entry[0] < max_num):
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self._entries.move_to_end(key)
+        count, joined, _ = entry
+        if not count:
+            return []
+        return joined.split('\n', max_num)[:max_num]
+
+    def set(self, key, results, complete):
+        self.pop(key)
+        joined = '\n'.join(results)
+        size = self._entry_size(key, joined)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (len(results), joined, complete)
+        self.size += size
+        while self.size > self.max_bytes:
+            old_key, (_, old_joined, _) = self._entries.popitem(last=False)
+            self.size -= self._entry_size(old_key, old_joined)
+            self.stats.evicted()
+
+    def pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= self._entry_size(key, entry[1])
+
+    @staticmethod
+    def _entry_size(key, joined):
+        return sys.getsizeof(joined) + sys.getsizeof(key[0])
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
 
 
 class WordStorage:
@@ -81,95 +246,352 @@ class WordStorage:
             *,
             all_words='words.txt',
             common_words='google-10000-english-no-swears.txt',
-            long_words='google-10000-english-usa-no-swears-long.txt'
+            long_words='google-10000-english-usa-no-swears-long.txt',
+            index_file='words.idx',
+            engine='matrix',
+            cache_bytes=8 * 1024 * 1024,
     ):
+        """
+        :param engine: How single word candidates are found. ``matrix`` checks every set of a fitting length
+                       with numpy, ``trie`` walks a letter trie and only visits branches the letters can still pay for.
+        :param cache_bytes: Roughly how much memory cached anagram() results can take up. 0 turns it off.
+        """
+        if engine not in ENGINES:
+            raise ValueError('Unknown anagram engine {0}'.format(engine))
+        self.engine = engine
         # Use str(fp) just in case it's already a path object
         word_path = pathlib.Path(str(fp) + '/' + str(all_words))
         common_path = pathlib.Path(str(fp) + '/' + str(common_words))
         long_path = pathlib.Path(str(fp) + '/' + str(long_words))
+        index_path = pathlib.Path(str(fp) + '/' + str(index_file))
 
-        self.words = defaultdict(dict)
-        for line in word_path.read_text().splitlines():
-            line_length = len(line)
-            if line_length < 1:
-                continue
-            if line[0] == '#':
-                # Comments (mainly license and credits)
-                continue
-            line_sort = ''.join(sorted(line))
-            word_set = self.words[line_length].get(line_sort)
-            if word_set:
-                word_set.append(line)
-                continue
-            self.words[len(line)][line_sort] = AnagramSet(line)
-        print(sum([len(word.values()) for word in self.words.values()]))
-
-        self.common_words = []
-        for line in common_path.read_text().splitlines():
-            if len(line) < 1:
-                continue
-            if line[0] == '#':
-                continue
-            word = Word(line)
-            self.common_words.append(word)
-
-        self.long_words = []
-        for line in long_path.read_text().splitlines():
-            if len(line) < 1:
-                continue
-            if line[0] == '#':
-                continue
-            word = Word(line)
-            self.long_words.append(word)
-
-    def _find_anagram(self, min_length, base, *, multi_word=False, cache=None, exact=False):
+        # Letter counts and words live in a memory mapped file that gets rebuilt when the word lists change.
+        # Set ids are sorted by length, so every length is one contiguous block of rows.
+        self.index = word_index.load_index(word_path, common_path, long_path, index_path)
+
+        # Letters ordered from least to most used, so the exact multi word search branches on the rare ones
+        self._letter_rarity = np.argsort(self.index.counts.sum(axis=0, dtype=np.int64), kind='stable')
+
+        self._trie = None
+        self.cache = AnagramCache(cache_bytes)
+
+        self.common_words = WordList(self.index, 'common')
+        self.long_words = WordList(self.index, 'long')
+
+    def _find_anagram(self, min_length, base, *, multi_word=False, exact=False, engine=None, ranked=False):
+        counts = base.counts
+        blanks = base.blanks
+        if multi_word and (ranked or blanks):
+            raise ValueError('Multi word anagrams can not be ranked or have blanks')
+        if ranked:
+            yield from self._ranked_words(min_length, counts, exact=exact, blanks=blanks)
+            return
+        if multi_word:
+            yield from self._find_phrases(min_length, counts, exact=exact, engine=engine)
+            return
+        letters = base.letters
+        for set_id in self._fitting_sets(min_length, counts, engine=engine, blanks=blanks):
+            words = self.index.set_words(set_id)
+            if not exact or len(words[0]) == letters:
+                yield from words
+
+    def _fitting_sets(self, min_length, counts, *, engine=None, blanks=0):
+        """Set ids (in scan order) of every anagram set that can be made out of counts and blanks."""
+        if (engine or self.engine) == 'trie':
+            return self._trie_sets(min_length, counts, blanks)
+        return self._matrix_sets(min_length, counts, blanks)
+
+    def _matrix_sets(self, min_length, counts, blanks=0):
+        start, _ = self.index.bucket(min_length)
+        _, end = self.index.bucket(min(int(counts.sum()) + blanks, self.index.max_length))
+        end = max(start, end)
+        # A set fits when it doesn't need more of any letter than the base has
+        mask = fits(self.index.counts[start:end], counts, blanks)
+        return np.flatnonzero(mask) + start
+
+    def _ranked_words(self, min_length, counts, *, exact=False, blanks=0):
+        """
+        Single word anagrams from most to least common. Goes through the index's rank order a chunk at a time,
+        so asking for the top few only checks the start of it.
+        """
+        # Same as Word.letters, so ranking only ever changes the order
+        max_length = int(counts.sum()) + blanks
+        if exact:
+            if max_length < min_length:
+                return
+            min_length = max_length
+        order = self.index.rank_order
+        chunk = 512
+        start = 0
+        while start < len(order):
+            string_ids = order[start:start + chunk]
+            set_ids = self.index.word_sets[string_ids]
+            # Sets are sorted by length, so which bucket a set id is in is its length
+            lengths = np.searchsorted(self.index.buckets, set_ids, side='right') - 1
+            mask = (lengths >= min_length) & (lengths <= max_length)
+            mask[mask] = fits(self.index.counts[set_ids[mask]], counts, blanks)
+            for string_id in string_ids[mask]:
+                yield self.index.string(int(string_id))
+            start += chunk
+            # Past the common words results get rare, so don't bother stopping as often
+            chunk = min(chunk * 2, 65536)
+
+    def _trie_views(self):
+        if self._trie is None:
+            self._trie = tuple(self.index.view(name) for name in ('trie_first', 'trie_children', 'trie_letter', 'trie_set'))
+        return self._trie
+
+    def _trie_sets(self, min_length, counts, blanks=0):
+        first, children, letters, sets = self._trie_views()
+        remaining = counts.tolist()
         found = []
-        if cache is None:
-            # Build cache for multi word anagrams
-            # We know that further anagrams only exist within anagrams of the main word
-            for i in range(min_length, base.length + 1):
-                for word_set in self.words[i].values():
-                    if word_set in base:
-                        if not exact or len(word_set) == len(base):
-                            # Return words if applicable
-                            for word in word_set.words:
-                                yield word.word
-                        found.append(word_set)
-        else:
-            # Check cache for previous matches and see if they are applicable
-            for word_set in cache:
-                if word_set in base:
-                    for word in word_set.words:
-                        if not exact or len(word_set) == len(base):
-                            yield word.word
-                    found.append(word_set)
-        if not multi_word:
-            # Stop searching
+
+        def walk(node, depth, blanks):
+            set_id = sets[node]
+            if set_id >= 0 and depth >= min_length:
+                found.append(set_id)
+            start = first[node]
+            for child in range(start, start + children[node]):
+                letter = letters[child]
+                # Whole branch gets skipped once a letter (and every blank) runs out
+                if remaining[letter]:
+                    remaining[letter] -= 1
+                    walk(child, depth + 1, blanks)
+                    remaining[letter] += 1
+                elif blanks:
+                    walk(child, depth + 1, blanks - 1)
+
+        walk(0, 0, blanks)
+        # The trie goes in key order, sort back into scan order so both engines give the same output
+        found.sort()
+        return np.array(found, dtype=np.int64)
+
+    def _find_phrases(self, min_length, counts, *, exact=False, engine=None):
+        """
+        Multi word anagrams. Every phrase is only built one way, so "a b" and "b a" don't both show up and
+        the same leftover letters aren't searched again for every order of the words picked before them.
+
+        Without exact, words are picked in candidate order (each next word comes from the same set or a later one).
+        With exact all letters have to get used, so the next word always has to cover the rarest letter that's
+        left. Words covering the same letter are picked in candidate order. Leftover letter signatures that can't
+        be used up get memoized as dead ends and are never walked into.
+
+        Inputs with lots of different letters still have a huge number of phrases. A full exact search of the
+        alphabet takes around a minute, so searches from the bot go through AnagramService and its time budget.
+        """
+        candidates = self._fitting_sets(min_length, counts, engine=engine)
+        matrix = self.index.counts[candidates]
+        lengths = matrix.sum(axis=1, dtype=np.int64)
+        with_letter = [np.flatnonzero(matrix[:, letter]) for letter in range(len(alphabet))]
+        fits = {}
+        viable = {}
+
+        def next_positions(remaining, remaining_length, start, letter=None):
+            signature = remaining.tobytes()
+            positions = fits.get(signature)
+            if positions is None:
+                if letter is None:
+                    positions = np.arange(len(candidates))
+                else:
+                    positions = with_letter[letter]
+                # Candidates are sorted by length, so anything past this can't fit anymore
+                positions = positions[:np.searchsorted(lengths[positions], remaining_length, side='right')]
+                positions = positions[(matrix[positions] <= remaining).all(axis=1)]
+                fits[signature] = positions
+            return positions[np.searchsorted(positions, start):]
+
+        def walk(prefix, remaining, remaining_length, start):
+            # Every phrase at this depth first, then the longer ones
+            steps = []
+            for position in next_positions(remaining, remaining_length, start):
+                steps.append(position)
+                yield prefix + (position,)
+            for position in steps:
+                left_length = remaining_length - lengths[position]
+                if left_length >= min_length:
+                    yield from walk(prefix + (position,), remaining - matrix[position], left_length, position)
+
+        if not exact:
+            yield from self._expand_phrases(candidates, walk((), counts, int(counts.sum()), 0))
             return
-        for word in found:
-            # Create copy with found anagram removed.
-            base_copy = base.copy()
-            base_copy.remove(word.words[0])
-            if len(base_copy) < min_length:
-                extra_found = []
+
+        rarity = self._letter_rarity
+
+        def rarest(remaining):
+            return int(rarity[np.argmax(remaining[rarity] > 0)])
+
+        def exact_steps(remaining, remaining_length, start):
+            letter = rarest(remaining)
+            for position in next_positions(remaining, remaining_length, start, letter):
+                left = remaining - matrix[position]
+                left_length = remaining_length - lengths[position]
+                if left_length == 0:
+                    yield position, left, left_length, None
+                    continue
+                if left_length < min_length:
+                    # Nothing short enough is left to use up the letters
+                    continue
+                # Keep candidate order while the same letter still has to be covered
+                next_start = position if left[letter] else 0
+                if can_finish(left, left_length, next_start):
+                    yield position, left, left_length, next_start
+
+        def can_finish(remaining, remaining_length, start):
+            key = (remaining.tobytes(), start)
+            result = viable.get(key)
+            if result is None:
+                result = next(exact_steps(remaining, remaining_length, start), None) is not None
+                viable[key] = result
+            return result
+
+        def walk_exact(prefix, remaining, remaining_length, start):
+            for position, left, left_length, next_start in exact_steps(remaining, remaining_length, start):
+                if next_start is None:
+                    yield prefix + (position,)
+                else:
+                    yield from walk_exact(prefix + (position,), left, left_length, next_start)
+
+        yield from self._expand_phrases(candidates, walk_exact((), counts, int(counts.sum()), 0))
+
+    def _count_phrases(self, min_length, counts, *, exact=False):
+        """
+        How many phrases _find_phrases would give, without building any of them.
+
+        Goes through the candidates once, keeping how many ways there are to end up with every leftover letter
+        signature. Using a set r times can be done in (words in set + r - 1 choose r) ways, same as _phrase_words.
+        With exact, candidates are grouped by their rarest letter. Once a letter's group is done nothing later can
+        use that letter up, so leftovers still holding it get dropped.
+        """
+        candidates = self._fitting_sets(min_length, counts)
+        matrix = self.index.counts[candidates]
+        sizes = (self.index.set_offsets[candidates + 1] - self.index.set_offsets[candidates]).tolist()
+        signatures = [int.from_bytes(row.tobytes(), 'little') for row in matrix]
+
+        rarity = self._letter_rarity
+        rank = np.empty(len(alphabet), dtype=np.int64)
+        rank[rarity] = np.arange(len(alphabet))
+        rarest = np.where(matrix > 0, rank, len(alphabet)).min(axis=1).tolist()
+        groups = collections.defaultdict(list)
+        for position, letter_rank in enumerate(rarest):
+            groups[letter_rank].append(position)
+
+        ways = {int.from_bytes(counts.tobytes(), 'little'): 1}
+        for letter_rank in range(len(alphabet)):
+            for position in groups[letter_rank]:
+                signature = signatures[position]
+                size = sizes[position]
+                for left, left_ways in list(ways.items()):
+                    repeat = 1
+                    while signature_fits(signature, left):
+                        left -= signature
+                        ways[left] = ways.get(left, 0) + left_ways * math.comb(size + repeat - 1, repeat)
+                        repeat += 1
+            if exact:
+                letter_mask = 0xff << (8 * int(rarity[letter_rank]))
+                ways = {left: left_ways for left, left_ways in ways.items() if not left & letter_mask}
+        if exact:
+            return ways.get(0, 0)
+        # Everything except not using any word
+        return sum(ways.values()) - 1
+
+    def _expand_phrases(self, candidates, phrases):
+        for phrase in phrases:
+            yield from self._phrase_words(sorted(int(candidates[position]) for position in phrase))
+
+    def _phrase_words(self, set_ids):
+        """Expands set ids into the actual phrases. Repeated sets only use each combination of words once."""
+        groups = [
+            itertools.combinations_with_replacement(self.index.set_words(set_id), len(list(group)))
+            for set_id, group in itertools.groupby(set_ids)
+        ]
+        for combination in itertools.product(*groups):
+            yield ' '.join(itertools.chain.from_iterable(combination))
+
+    def is_word(self, word):
+        """If word is in the dictionary. Follows the word's sorted letters down the trie, so it's O(length)."""
+        first, children, letters, sets = self._trie_views()
+        node = 0
+        for letter in sorted(word.lower()):
+            letter = ord(letter) - ord('a')
+            start = first[node]
+            for child in range(start, start + children[node]):
+                if letters[child] == letter:
+                    node = child
+                    break
             else:
-                # Recursion
-                extra_found = self._find_anagram(min_length, base_copy, cache=found, multi_word=multi_word, exact=exact)
-            for w in word.words:
-                # Return built phrases
-                for e in extra_found:
-                    yield w.word + ' ' + e
-        return
-
-    def anagram(self, word, *, min_length=1, multi_word=False, max_num=5000, exact=False):
+                return False
+        set_id = sets[node]
+        return set_id >= 0 and word.lower() in self.index.set_words(set_id)
+
+    def find_sets(self, word, *, min_length=1, engine=None):
+        """Set ids of every anagram set that fits in word. Words of a set are in self.index.set_words."""
+        return self._fitting_sets(min_length, Word(word).counts, engine=engine)
+
+    def iter_anagrams(self, word, *, min_length=1, multi_word=False, exact=False, engine=None, ranked=False):
+        """
+        Lazily yields anagrams of word. Stopping early skips the rest of the search.
+
+        :param ranked: Most common words first instead of scan order. Only for single words
+        """
         # First construct into a word for usability
-        word = Word(word)
-        words = []
-        for i, w in enumerate(self._find_anagram(min_length, word, multi_word=multi_word, exact=exact)):
-            if i >= max_num:
-                return words
-            words.append(w)
+        return self._find_anagram(
+            min_length, Word(word), multi_word=multi_word, exact=exact, engine=engine, ranked=ranked,
+        )
+
+    def count_anagrams(self, word, *, min_length=1, multi_word=False, exact=False):
+        """
+        How many anagrams iter_anagrams would yield, without building any strings.
+
+        Multi word counts work through every leftover letter combination, so they get slow past 20 or so letters.
+        """
+        base = Word(word)
+        counts = base.counts
+        if multi_word:
+            if base.blanks:
+                raise ValueError('Multi word anagrams can not have blanks')
+            return self._count_phrases(min_length, counts, exact=exact)
+        set_ids = self._fitting_sets(min_length, counts, blanks=base.blanks)
+        if exact:
+            set_ids = set_ids[self.index.counts[set_ids].sum(axis=1) == base.letters]
+        return int((self.index.set_offsets[set_ids + 1] - self.index.set_offsets[set_ids]).sum())
+
+    def has_anagram(self, word, *, min_length=1, multi_word=False, exact=False):
+        """If iter_anagrams would yield anything."""
+        base = Word(word)
+        if multi_word and base.blanks:
+            raise ValueError('Multi word anagrams can not have blanks')
+        if base.blanks:
+            return self.count_anagrams(word, min_length=min_length, exact=exact) > 0
+        if exact and not multi_word:
+            key = ''.join(letter * int(count) for letter, count in zip(alphabet, base.counts))
+            return len(key) >= min_length and self.index.find_key(key) is not None
+        if exact:
+            # Stops at the first phrase that uses everything
+            return next(self._find_phrases(min_length, base.counts, exact=True), None) is not None
+        # Any single word that fits is a phrase too
+        return len(self._fitting_sets(min_length, base.counts)) > 0
+
+    def anagram(self, word, *, min_length=1, multi_word=False, max_num=5000, exact=False, engine=None):
+        key = AnagramCache.create_key(word, min_length, multi_word, exact)
+        cached = self.cache.get(key, max_num)
+        if cached is not None:
+            return cached
+        started = time.perf_counter()
+        found = self.iter_anagrams(word, min_length=min_length, multi_word=multi_word, exact=exact, engine=engine)
+        # One extra to know if the search got cut off
+        words = list(itertools.islice(found, max_num + 1))
+        self.cache.stats.record_load(time.perf_counter() - started)
+        complete = len(words) <= max_num
+        words = words[:max_num]
+        self.cache.set(key, words, complete)
         return words
 
-    def get_anagram_word(self, length):
-        return random.choice(self.long_words).word[:length]
+    def get_anagram_word(self, length, *, min_length=1, min_count=1, tries=100):
+        """
+        Start of a random long word. Seeds with less than min_count anagrams get rerolled, up to tries times.
+        """
+        for _ in range(tries):
+            word = random.choice(self.long_words).word[:length]
+            if self.count_anagrams(word, min_length=min_length) >= min_count:
+                return word
+        return word